@@ -7,37 +7,58 @@
 """Interface to Geoserver REST API."""
 
 
+import asyncio
+import collections
 import datetime as dt
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     import requests
 except ImportError:
     requests = None
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
 import trollsift
 from geoserver.catalog import Catalog, FailedRequestError
-from geoserver.support import DimensionInfo, write_string
+from geoserver.support import DimensionInfo, build_url, write_string
 
 from georest import utils
 
 # These layer attributes can be set
 LAYER_ATTRIBUTES = ["title", "abstract", "keywords"]
 LAYER_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f%z"
+GRANULE_URL = "{host}workspaces/{workspace}/coveragestores/{layer_name}/external.imagemosaic"
 S3_PROPERTY_URL = "{host}workspaces/{workspace}/coveragestores/{layer_name}/file.imagemosaic?configure=none"
 S3_GRANULE_URL = "{host}workspaces/{workspace}/coveragestores/{layer_name}/remote.imagemosaic"
 S3_COVERAGE_URL = "{host}workspaces/{workspace}/coveragestores/{layer_name}/coverages"
+RECALCULATE_URL = ("{host}workspaces/{workspace}/coveragestores/{layer_name}/coverages/{coverage}.xml"
+                   "?recalculate=nativebbox,latlonbbox")
+# Number of granules requested at once when iterating over the granules
+GRANULE_PAGE_SIZE = 1000
 
 logger = logging.getLogger(__name__)
 
 
 def connect_to_gs_catalog(config):
-    """Connect to Geoserver."""
+    """Connect to Geoserver.
+
+    The object lookups are cached for 'catalog_cache_ttl' seconds (default: 60).
+    Setting it to zero disables the caching.
+    """
     cat = Catalog(config.get("host"),
                   config.get("user"),
                   config.get("passwd"))
     logger.debug("Connected to Geoserver at %s", config.get("host"))
 
+    ttl = config.get("catalog_cache_ttl", 60)
+    if ttl:
+        cat = utils.CachingCatalog(cat, ttl=ttl, max_size=config.get("catalog_cache_size", 1024))
     return cat
 
 
@@ -71,82 +92,195 @@ def _collect_layer_metadata(config, layer_config):
 
 
 def _create_layers(config, cat, property_file):
-    """Create all configured layers."""
+    """Create all configured layers.
+
+    The layers are created in parallel if 'create_workers' is set in the config.
+    """
     workspace = config["workspace"]
-    dimensions = config["dimensions"]
+    workers = config.get("create_workers", 1)
 
     # Make sure the workspace exists
     create_workspace(workspace, cat)
 
     layer_directories = utils.get_exposed_layer_directories(config)
 
+    # Write WKT to .prj for all existing files before creating the
+    #   layers.  This is optional, and can help with files without
+    #   embedded projection metadata, or the embedded metadata is in a format
+    #   Geoserver doesn't understand.
+    if config.get("write_wkt"):
+        utils.write_wkt_for_directories(config, layer_directories.values(), workers=config.get("wkt_workers", 4))
+
     # Create all the configured layers and add time dimension
-    for layer_config in config["layers"]:
-        meta = _collect_layer_metadata(config, layer_config)
-        layer_name = meta['layer_name']
-        if layer_name is None:
-            logger.error("No layer name defined!")
-            logger.error("Config items: %s", str(meta))
-            continue
+    if workers > 1:
+        _limit_concurrent_requests(cat, config.get("max_host_requests", workers))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                lambda layer_config: _provision_layer(config, cat, property_file, layer_config),
+                config["layers"]))
+    else:
+        results = [_provision_layer(config, cat, property_file, layer_config)
+                   for layer_config in config["layers"]]
+    _log_provisioning_summary(results)
 
-        # Write WKT to .prj for all existing files before creating the
-        #   layer.  This is optional, and can help with files without
-        #   embedded projection metadata, or the embedded metadata is in a format
-        #   Geoserver doesn't understand.
-        utils.write_wkt_for_files(config, layer_directories[layer_name])
 
-        if _create_layer(cat, workspace, layer_name, property_file):
-            if not add_layer_metadata(cat, workspace, layer_name, dimensions, meta, style=config.get("style")):
-                continue
+def _provision_layer(config, cat, property_file, layer_config):
+    """Create and configure a layer, and return the layer name, success and the elapsed time."""
+    start_time = time.time()
+    workspace = config["workspace"]
+    meta = _collect_layer_metadata(config, layer_config)
+    layer_name = meta['layer_name']
+    if layer_name is None:
+        logger.error("No layer name defined!")
+        logger.error("Config items: %s", str(meta))
+        return None, False, 0.0
+
+    try:
+        success = _create_layer(cat, workspace, layer_name, property_file)
+        if success:
+            success = add_layer_metadata(cat, workspace, layer_name, config["dimensions"], meta,
+                                         style=config.get("style"))
+        if success:
             # Delete the empty image from database (does not remove the file)
             for fname in config["properties"].get("files", []):
                 delete_granule(cat, workspace, layer_name, fname)
+    except Exception:
+        logger.exception("Creating layer '%s' failed", layer_name)
+        success = False
+    return layer_name, success, time.time() - start_time
+
+
+def _log_provisioning_summary(results):
+    for layer_name, success, elapsed in sorted(results, key=lambda res: res[2], reverse=True):
+        if layer_name is None:
+            continue
+        if success:
+            logger.info("%s: done in %.1f s", layer_name, elapsed)
+        else:
+            logger.info("%s: failed after %.1f s", layer_name, elapsed)
+    num_ok = sum(1 for _, success, _ in results if success)
+    logger.info("%d of %d layer(s) created or updated", num_ok, len(results))
 
 
 def add_layer_metadata(cat, workspace, layer_name, dimensions, meta, style=None):
-    """Add metadata for the given layer."""
+    """Add metadata for the given layer.
+
+    Only the values that differ from the current ones are sent to Geoserver,
+    and nothing is saved if the layer is already up to date.
+    """
     coverage = cat.get_resource(workspace=workspace, store=layer_name)
     if coverage is None:
         logger.error("Could not get coverage for workspace '%s' and store '%s'",
                      workspace, layer_name)
         return False
+    changed = False
     for attribute in LAYER_ATTRIBUTES:
         if attribute in meta:
             attr = _get_and_clean_attribute(meta[attribute])
             if isinstance(attr, str):
                 attr = trollsift.compose(attr, meta)
-            setattr(coverage, attribute, attr)
+            if getattr(coverage, attribute) != attr:
+                setattr(coverage, attribute, attr)
+                changed = True
 
     # Add dimensions
     for _, dim in dimensions.items():
-        coverage = add_dimension(coverage, dim)
-
-    coverage = _add_cache_age_max(coverage, meta.get("cache_age_max", None))
-    coverage = _add_projection_policy(coverage, meta.get("projection_policy", None))
+        if not _dimension_is_current(coverage.metadata.get(dim["name"]), dim):
+            coverage = add_dimension(coverage, dim)
+            changed = True
+
+    cache_age_max = meta.get("cache_age_max", None)
+    if cache_age_max is not None and not _cache_age_max_is_current(coverage.metadata, cache_age_max):
+        coverage = _add_cache_age_max(coverage, cache_age_max)
+        changed = True
+    projection_policy = meta.get("projection_policy", None)
+    if projection_policy is not None and coverage.projection_policy != projection_policy:
+        coverage = _add_projection_policy(coverage, projection_policy)
+        changed = True
 
     # Save the added metadata
-    cat.save(coverage)
+    if changed:
+        cat.save(coverage)
 
     if style is not None:
-        # Add default style for layer
-        layer = cat.get_layer(layer_name)
+        changed |= _set_layer_styles(cat, workspace, layer_name, style)
+    if changed:
+        logger.info(
+            "Metadata written for layer '%s' on workspace '%s'", layer_name, workspace
+        )
+    else:
+        logger.info("Metadata for layer '%s' on workspace '%s' is up to date", layer_name, workspace)
+    return True
+
 
+def _dimension_is_current(current, dim):
+    """Check if the *current* dimension info matches the configured *dim*."""
+    if current is None:
+        return False
+    desired = DimensionInfo(dim["name"], dim["enabled"], dim["presentation"],
+                            resolution=dim.get("resolution"), units=dim.get("units"),
+                            unitSymbol=dim.get("unitSymbol"), strategy=dim.get("strategy"),
+                            nearestMatchEnabled=dim.get("nearestMatchEnabled"))
+    try:
+        if current.resolution_millis() != desired.resolution_millis():
+            return False
+    except (AttributeError, ValueError):
+        return False
+    return all(_normalize_value(getattr(current, attr, None)) == _normalize_value(getattr(desired, attr))
+               for attr in ("enabled", "presentation", "units", "unitSymbol", "strategy", "nearestMatchEnabled"))
+
+
+def _normalize_value(value):
+    """Convert values to the strings used by Geoserver for comparison."""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
+
+
+def _cache_age_max_is_current(metadata, cache_age_max):
+    return metadata.get("cacheAgeMax") == str(cache_age_max) and metadata.get("cachingEnabled") == "true"
+
+
+def _set_layer_styles(cat, workspace, layer_name, style):
+    """Set the default and additional styles of the layer if they have changed.
+
+    Return True if the layer was saved.
+    """
+    layer = cat.get_layer(layer_name)
+    current_default, current_additional = _get_style_names(layer)
+    additional_styles = style.get("additional_styles") or []
+    changed = False
+
+    # Add default style for layer
+    if current_default != style["default_style"]["name"]:
         layer._set_default_style(
             cat.get_style(style["default_style"]["name"], workspace=style["default_style"].get("workspace"))
         )
+        changed = True
 
-        # Set additional styles
-        if style.get("additional_styles"):
-            gs_styles = []
-            for style_ in style["additional_styles"]:
-                gs_styles.append(cat.get_style(style_["name"], workspace=style_.get("workspace")))
-            layer._set_alternate_styles(gs_styles)
+    # Set additional styles
+    if additional_styles and current_additional != [style_["name"] for style_ in additional_styles]:
+        gs_styles = []
+        for style_ in additional_styles:
+            gs_styles.append(cat.get_style(style_["name"], workspace=style_.get("workspace")))
+        layer._set_alternate_styles(gs_styles)
+        changed = True
 
+    if changed:
         cat.save(layer)
-    logger.info(
-        "Metadata written for layer '%s' on workspace '%s'", layer_name, workspace
-    )
-    return True
+    return changed
+
+
+def _get_style_names(layer):
+    """Get the names of the default and additional styles of a layer without requesting the styles."""
+    if layer.dom is None:
+        layer.fetch()
+    default = layer.dom.find("defaultStyle/name")
+    default = default.text.split(":")[-1] if default is not None else None
+    additional = [elem.text.split(":")[-1] for elem in layer.dom.findall("styles/style/name")]
+    return default, additional
 
 
 def _get_and_clean_attribute(attribute):
@@ -256,17 +390,75 @@ def _send_properties(config, property_file, meta):
         _ = requests.put(url, data=data, headers=headers, auth=auth)
 
 
-def add_s3_granule(config, meta):
-    """Add a file in S3 bucket to image mosaic."""
+def add_s3_granule(config, meta, session=None):
+    """Add a file in S3 bucket to image mosaic.
+
+    If requests *session* is given, it is used to reuse the connection.
+
+    Return True if the granule was accepted by Geoserver.
+    """
     url = trollsift.compose(S3_GRANULE_URL, meta)
     data = meta['image_url']
     headers = {'Content-type': 'text/plain'}
     auth = (config['user'], config['passwd'])
-    req = requests.post(url, data=data, headers=headers, auth=auth)
+    post = requests.post if session is None else session.post
+    req = post(url, data=data, headers=headers, auth=auth)
     if req.status_code == requests.codes.accepted:
         logger.info(f"Granule '{data}' added to '{meta['workspace']}:{meta['layer_name']}'")
+        return True
+    logger.error(f"Adding granule '{data}' failed with status code {req.status_code}")
+    return False
+
+
+def add_granule_without_recalculation(config, meta, filesystem='posix', session=None):
+    """Add a granule to image mosaic without recalculating the coverage extents.
+
+    Call :func:`recalculate_coverage` after the granules have been added.  If
+    requests *session* is given, it is used to reuse the connection.
+
+    Return True if the granule was accepted by Geoserver.
+    """
+    if requests is None:
+        raise ImportError("'requests' is needed for deferred coverage recalculation.")
+    if filesystem == 's3':
+        url = _compose_url(S3_GRANULE_URL, meta)
+        data = meta['image_url']
     else:
-        logger.error(f"Adding granule '{data}' failed with status code {req.status_code}")
+        url = _compose_url(GRANULE_URL, meta)
+        data = "file:" + meta['image_url']
+    params = {'configure': 'none', 'updateBBox': 'false'}
+    headers = {'Content-type': 'text/plain'}
+    auth = (config['user'], config['passwd'])
+    post = requests.post if session is None else session.post
+    req = post(url, data=data, params=params, headers=headers, auth=auth)
+    if req.status_code == requests.codes.accepted:
+        logger.info(f"Granule '{data}' added to '{meta['workspace']}:{meta['layer_name']}'")
+        return True
+    logger.error(f"Adding granule '{data}' failed with status code {req.status_code}")
+    return False
+
+
+def recalculate_coverage(config, cat, store):
+    """Recalculate the bounding boxes of the coverage of *store*.
+
+    Return True if the recalculation succeeded.
+    """
+    if requests is None:
+        raise ImportError("'requests' is needed for deferred coverage recalculation.")
+    workspace = config["workspace"]
+    store_obj = cat.get_store(store, workspace)
+    coverage = get_layer_coverage(cat, store, store_obj)
+    meta = {'host': config['host'], 'workspace': workspace, 'layer_name': store, 'coverage': coverage['name']}
+    url = _compose_url(RECALCULATE_URL, meta)
+    headers = {'Content-type': 'text/xml'}
+    auth = (config['user'], config['passwd'])
+    req = requests.put(url, data="<coverage><enabled>true</enabled></coverage>", headers=headers, auth=auth)
+    if req.status_code == requests.codes.ok:
+        logger.info("Coverage of '%s:%s' recalculated", workspace, store)
+        return True
+    logger.error("Recalculating coverage of '%s:%s' failed with status code %d",
+                 workspace, store, req.status_code)
+    return False
 
 
 def _configure_coverage(config, meta):
@@ -307,13 +499,34 @@ def get_layer_coverage(cat, store, store_obj):
     return coverage
 
 
-def get_layer_granules(cat, coverage, store_obj):
-    """Get all granules in a layer."""
-    granules = cat.list_granules(coverage['name'], store_obj)
+def get_layer_granules(cat, coverage, store_obj, cql_filter=None):
+    """Get all granules in a layer.
+
+    If *cql_filter* is given, only the granules matching it are returned.
+    """
+    granules = cat.list_granules(coverage['name'], store_obj, filter=cql_filter)
 
     return granules
 
 
+def iter_layer_granules(cat, coverage, store_obj, cql_filter=None, page_size=GRANULE_PAGE_SIZE):
+    """Iterate over the granules in a layer.
+
+    The granules are requested from Geoserver *page_size* granules at a time,
+    so only one page needs to be kept in memory.  If *cql_filter* is given,
+    only the granules matching it are returned.
+    """
+    offset = 0
+    while True:
+        granules = cat.list_granules(coverage['name'], store_obj, filter=cql_filter,
+                                     limit=page_size, offset=offset)
+        features = granules.get("features", [])
+        yield from features
+        if len(features) < page_size:
+            return
+        offset += page_size
+
+
 def add_file_to_mosaic(config, fname_in, filesystem='posix'):
     """Add a file to image mosaic.
 
@@ -321,31 +534,162 @@ def add_file_to_mosaic(config, fname_in, filesystem='posix'):
 
     """
     fname = utils.convert_file_path(config, fname_in, keep_subpath=config.get("keep_subpath", False))
-    identity_check_seconds = config.get("identity_check_seconds")
-
     store = _get_store_name_from_filename(config, fname)
 
     cat = connect_to_gs_catalog(config)
+    added = _add_file(config, cat, store, fname_in, fname, filesystem)
+    if added and config.get("evict_on_add", False):
+        evict_old_granules(config, cat, store)
+
+
+def add_files_to_mosaics(config, fnames_in, filesystem='posix'):
+    """Add several files to image mosaics.
+
+    The files are grouped by the layer and added using a single connection.
+    The existing granules of each layer are listed only once for the
+    duplicate check.
+
+    Return the number of added granules.
+
+    """
+    stores = collections.defaultdict(list)
+    for fname_in in fnames_in:
+        fname = utils.convert_file_path(config, fname_in, keep_subpath=config.get("keep_subpath", False))
+        store = _route_filename(config, fname)
+        if store is not None:
+            stores[store].append((fname_in, fname))
+
+    cat = connect_to_gs_catalog(config)
+    granule_index = utils.GranuleIndex(cat, config["workspace"], config["file_pattern"])
+    harvest = filesystem == 'posix' and config.get("bulk_harvest", False)
+    defer = config.get("defer_recalculation", False)
+    session = None
+    if defer or filesystem == 's3':
+        if requests is None:
+            raise ImportError("'requests' is needed for deferred coverage recalculation and S3 granules.")
+        session = requests.Session()
+    num = 0
+    for store, files in stores.items():
+        num_store = 0
+        if harvest:
+            num_store, files = _harvest_new_directories(config, cat, store, files, granule_index)
+        for fname_in, fname in files:
+            if _add_file(config, cat, store, fname_in, fname, filesystem,
+                         granule_index=granule_index, session=session, defer=defer):
+                granule_index.add(store, fname)
+                num_store += 1
+        if num_store and defer:
+            recalculate_coverage(config, cat, store)
+        if num_store and config.get("evict_on_add", False):
+            evict_old_granules(config, cat, store)
+        num += num_store
+    logger.info("%d of %d file(s) added to %d layer(s)", num, len(fnames_in), len(stores))
+    return num
+
+
+def _harvest_new_directories(config, cat, store, files, granule_index):
+    """Harvest the directories where all the images are new with a single request per directory.
+
+    Return the number of harvested granules and the files that still need to be added.
+    """
+    directories = collections.defaultdict(list)
+    for fname_in, fname in files:
+        directories[os.path.dirname(fname_in)].append((fname_in, fname))
+
+    num = 0
+    remaining = []
+    for directory, dir_files in directories.items():
+        new_files = _reserve_new_files(config, cat, store, dir_files, granule_index)
+        basenames = {os.path.basename(fname_in) for fname_in, _ in new_files}
+        gs_directory = os.path.dirname(new_files[0][1]) if new_files else None
+        if (len(new_files) > 1 and _maps_to_geoserver_directory(config, directory, gs_directory) and
+                _directory_has_only(directory, basenames)):
+            for fname_in, _ in new_files:
+                utils.write_wkt(config, fname_in)
+            if harvest_granules(cat, config["workspace"], store, gs_directory):
+                num += len(new_files)
+                continue
+        for _, fname in new_files:
+            granule_index.remove(store, fname)
+        remaining.extend(new_files)
+    return num, remaining
+
+
+def _reserve_new_files(config, cat, store, files, granule_index):
+    """Get the files that are not in the *store*, and add them to the index."""
+    new_files = []
+    for fname_in, fname in files:
+        if utils.file_in_granules(cat, config["workspace"], store, fname,
+                                  config.get("identity_check_seconds"), config["file_pattern"],
+                                  granule_index=granule_index):
+            continue
+        granule_index.add(store, fname)
+        new_files.append((fname_in, fname))
+    return new_files
+
+
+def _maps_to_geoserver_directory(config, directory, gs_directory):
+    """Check that the local *directory* is the directory Geoserver sees as *gs_directory*."""
+    directory = directory or os.curdir
+    if config.get("keep_subpath", False):
+        expected = utils.convert_file_path(config, directory, keep_subpath=True)
+    else:
+        # All the files are placed directly in 'geoserver_target_dir'
+        expected = config["geoserver_target_dir"]
+        if os.path.normpath(directory) != os.path.normpath(config.get("exposed_base_dir", os.curdir)):
+            return False
+    return os.path.normpath(expected) == os.path.normpath(gs_directory)
+
+
+def _directory_has_only(directory, basenames):
+    """Check that the files in *directory* are exactly *basenames* and their .prj files.
+
+    Geoserver tries to harvest every file in the directory, so any other file
+    or a subdirectory prevents the harvesting.
+    """
+    images = set()
+    with os.scandir(directory or os.curdir) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                return False
+            if entry.name.endswith(".prj"):
+                continue
+            if entry.name not in basenames:
+                return False
+            images.add(entry.name)
+    return images == basenames
+
+
+def _add_file(config, cat, store, fname_in, fname, filesystem, granule_index=None, session=None, defer=False):
+    """Add a file to the *store* unless it's already there.
+
+    If *defer* is True, the coverage extents are not recalculated.
+
+    Return True if the granule was added.
+    """
     workspace = config["workspace"]
     if utils.file_in_granules(cat, workspace, store, fname,
-                              identity_check_seconds, config["file_pattern"]):
-        return
+                              config.get("identity_check_seconds"), config["file_pattern"],
+                              granule_index=granule_index):
+        return False
+    if filesystem not in ('posix', 's3'):
+        raise NotImplementedError("Can't add granules to filesystem '%s'" % filesystem)
 
     # Add the granule metadata to Geoserver
     if filesystem == 'posix':
         # Write WKT to file if configured
         utils.write_wkt(config, fname_in)
-        add_granule(cat, workspace, store, fname)
-    elif filesystem == 's3':
-        meta = {
-            'host': config['host'],
-            'workspace': workspace,
-            'layer_name': store,
-            'image_url': fname,
-        }
-        add_s3_granule(config, meta)
-    else:
-        raise NotImplementedError("Can't add granules to filesystem '%s'" % filesystem)
+    meta = {
+        'host': config.get('host'),
+        'workspace': workspace,
+        'layer_name': store,
+        'image_url': fname,
+    }
+    if defer:
+        return add_granule_without_recalculation(config, meta, filesystem=filesystem, session=session)
+    if filesystem == 'posix':
+        return add_granule(cat, workspace, store, fname)
+    return add_s3_granule(config, meta, session=session)
 
 
 def add_granule(cat, workspace, store, file_path):
@@ -356,27 +700,92 @@ def add_granule(cat, workspace, store, file_path):
     store: name of the store/layer where file is added
     file_path: full path where the new file is in the geoserver host machine
 
+    Return True if the granule was added successfully.
+
     """
     try:
         cat.add_granule(file_path, store, workspace)
         logger.info("Granule '%s' added to '%s:%s'",
                     os.path.basename(file_path), workspace, store)
+        return True
     except (FailedRequestError, ConnectionRefusedError) as err:
         logger.error("Adding granule '%s' failed: %s", file_path, str(err))
+        return False
+
+
+def harvest_granules(cat, workspace, store, directory):
+    """Add all the files in a directory to image mosaic with a single request.
+
+    cat: Geoserver Catalog object
+    workspace: name of the used workspace
+    store: name of the store/layer where the files are added
+    directory: full path of the directory in the geoserver host machine
+
+    Return True if the directory was harvested successfully.
+
+    """
+    try:
+        cat.add_granule(directory, store, workspace)
+        logger.info("Directory '%s' harvested to '%s:%s'", directory, workspace, store)
+        return True
+    except (FailedRequestError, ConnectionRefusedError) as err:
+        logger.error("Harvesting directory '%s' failed: %s", directory, str(err))
+        return False
+
+
+def create_async_session(config):
+    """Create an aiohttp session for asynchronous requests to Geoserver."""
+    if aiohttp is None:
+        raise ImportError("'aiohttp' is needed for the asyncio engine.")
+    return aiohttp.ClientSession(auth=aiohttp.BasicAuth(config['user'], config['passwd']))
+
+
+def _compose_url(template, meta):
+    """Compose a REST URL, 'host' in *meta* may be given with or without the trailing slash."""
+    meta = dict(meta, host=meta['host'].rstrip('/') + '/')
+    return trollsift.compose(template, meta)
+
+
+async def async_add_granule(session, meta, filesystem='posix'):
+    """Add a file to image mosaic using an aiohttp session.
+
+    Return True if the granule was accepted by Geoserver.
+    """
+    if filesystem == 'posix':
+        url = _compose_url(GRANULE_URL, meta)
+        data = "file:" + meta['image_url']
+    elif filesystem == 's3':
+        url = _compose_url(S3_GRANULE_URL, meta)
+        data = meta['image_url']
+    else:
+        raise NotImplementedError("Can't add granules to filesystem '%s'" % filesystem)
+    headers = {'Content-type': 'text/plain'}
+    try:
+        async with session.post(url, data=data, headers=headers) as resp:
+            status = resp.status
+    except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+        logger.error("Adding granule '%s' failed: %s", meta['image_url'], str(err))
+        return False
+    if status == 202:
+        logger.info("Granule '%s' added to '%s:%s'",
+                    os.path.basename(meta['image_url']), meta['workspace'], meta['layer_name'])
+        return True
+    logger.error("Adding granule '%s' failed with status code %d", meta['image_url'], status)
+    return False
 
 
 def _get_store_name_from_filename(config, fname):
     """Parse store name from filename."""
-    file_pattern = config["file_pattern"]
-    file_parts = trollsift.parse(file_pattern, os.path.basename(fname))
+    return utils.get_filename_router(config).get_store(fname)
+
 
-    if "layer_id" in config:
-        layer_id = file_parts[config["layer_id"]]
-        return config["layers"][layer_id]
-    if "layer_name_template" in config:
-        layer_name = trollsift.compose(config["layer_name_template"], file_parts)
-        return layer_name
-    raise ValueError("Either 'layer_id' or 'layer_name_template' must be defined in config")
+def _route_filename(config, fname):
+    """Get the store name for *fname* in a batch, or None if the file can't be routed."""
+    try:
+        return _get_store_name_from_filename(config, fname)
+    except (KeyError, ValueError):
+        logger.warning("Can't find the layer for %s, skipping", fname)
+        return None
 
 
 def delete_file_from_mosaic(config, fname):
@@ -391,16 +800,59 @@ def delete_file_from_mosaic(config, fname):
     delete_granule(cat, config["workspace"], store, fname)
 
 
+def delete_files_from_mosaics(config, fnames):
+    """Delete several files from image mosaics.
+
+    The files are grouped by the layer, and the granules of each layer are
+    listed only once.
+
+    """
+    stores = collections.defaultdict(list)
+    for fname in fnames:
+        store = _route_filename(config, fname)
+        if store is not None:
+            stores[store].append(fname)
+
+    cat = connect_to_gs_catalog(config)
+    for store, store_fnames in stores.items():
+        delete_granules_by_name(cat, config["workspace"], store, store_fnames)
+
+
+def delete_granules_by_name(cat, workspace, store, fnames):
+    """Delete the granules of the given files from a layer.
+
+    Return the number of deleted granules.
+
+    """
+    store_obj = cat.get_store(store, workspace)
+    coverage = get_layer_coverage(cat, store, store_obj)
+    ids = collections.defaultdict(list)
+    for granule in iter_layer_granules(cat, coverage, store_obj):
+        ids[os.path.basename(granule['properties']['location'])].append(granule['id'])
+
+    num = 0
+    for fname in fnames:
+        fname = os.path.basename(fname)
+        if fname not in ids:
+            logger.warning("Granule '%s' not found in %s:%s", fname, workspace, store)
+            continue
+        for id_ in ids.pop(fname):
+            cat.delete_granule(coverage['name'], store_obj, id_, workspace)
+            num += 1
+        logger.info("Granule '%s' removed", fname)
+    return num
+
+
 def delete_granule(cat, workspace, store, fname):
     """Delete a file from image mosaic."""
     fname = os.path.basename(fname)
     store_obj = cat.get_store(store, workspace)
 
     coverage = get_layer_coverage(cat, store, store_obj)
-    granules = get_layer_granules(cat, coverage, store_obj)
+    granules = iter_layer_granules(cat, coverage, store_obj, cql_filter=utils.cql_location_filter(fname))
     # Find the ID for the file to be removed
     id_ = None
-    for granule in granules['features']:
+    for granule in granules:
         if fname in granule['properties']['location']:
             id_ = granule['id']
             break
@@ -410,27 +862,317 @@ def delete_granule(cat, workspace, store, fname):
         logger.info("Granule '%s' removed", fname)
 
 
-def delete_old_files_from_mosaics_and_fs(config):
+def delete_old_files_from_mosaics_and_fs(config, high_water_marks=None):
     """Delete a file from image mosaic.
 
     This functions wraps some boilerplate around deleting a granule from a layer.
 
+    The granules older than 'max_age' minutes are deleted.  Layer specific
+    rules, including the maximum number of granules and thinning of old
+    granules, can be given in 'retention_rules'.
+
+    The layers are cleaned in parallel if 'cleanup_workers' is set in the config.
+
+    If *high_water_marks* dictionary is given, only granules newer than the
+    time stored for each store are checked, and the times are updated after
+    the store has been cleaned.
+
+    """
+    cat = connect_to_gs_catalog(config)
+    now = dt.datetime.utcnow()
+    stores = utils.get_layers_for_delete_granules(config, cat=cat)
+    workers = config.get("cleanup_workers", 1)
+
+    deleter = None
+    if config.get("delete_files", False):
+        deleter = utils.FileDeleter(workers=config.get("delete_workers", 2),
+                                    batch_size=config.get("delete_batch_size", 100))
+
+    try:
+        if workers > 1:
+            _limit_concurrent_requests(cat, config.get("max_host_requests", workers))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(lambda store: _clean_store(config, cat, store, now, deleter,
+                                                                       high_water_marks),
+                                            stores))
+        else:
+            results = [_clean_store(config, cat, store, now, deleter, high_water_marks) for store in stores]
+    finally:
+        if deleter is not None:
+            deleter.close()
+    _log_cleanup_summary(results)
+
+
+def run_cleanup_daemon(config):
+    """Delete old granules and files every 'cleanup_interval' minutes.
+
+    Only the granules that have expired since the previous pass are requested
+    from Geoserver.  A full pass over all the granules is made every
+    'full_cleanup_interval' minutes, if set, to catch granules added with old
+    timestamps.
+
+    """
+    interval = 60 * config["cleanup_interval"]
+    full_interval = config.get("full_cleanup_interval")
+    high_water_marks = {}
+    last_full_pass = time.time()
+    while True:
+        start_time = time.time()
+        if full_interval is not None and start_time - last_full_pass >= 60 * full_interval:
+            logger.info("Running full cleanup pass")
+            high_water_marks.clear()
+            last_full_pass = start_time
+        try:
+            delete_old_files_from_mosaics_and_fs(config, high_water_marks=high_water_marks)
+        except Exception:
+            logger.exception("Cleanup pass failed, retrying on the next interval")
+        time.sleep(max(0, interval - (time.time() - start_time)))
+
+
+def evict_old_granules(config, cat, store):
+    """Delete the granules of *store* that are older than its 'max_age'.
+
+    This is meant to be called after adding a granule, so only the expired
+    granules are requested from Geoserver, and their files are deleted
+    directly.  The 'max_count' and thinning rules need a listing of all the
+    granules and are left for the periodic cleanup.  Errors are logged
+    instead of raised.  Return the number of deleted granules, or None if the
+    deletion failed.
+
     """
+    rule = utils.get_retention_rule(config, store)
+    if rule.get("max_age") is None:
+        return 0
+    max_age = dt.datetime.utcnow() - dt.timedelta(minutes=rule["max_age"])
+    deleter = utils.DirectFileDeleter() if config.get("delete_files", False) else None
+    try:
+        num = _delete_old_granules_from_store(config, cat, store, max_age, deleter)
+    except Exception:
+        logger.exception("Evicting old granules from '%s' failed", store)
+        return None
+    if num:
+        logger.info("%d old granule(s) evicted from %s", num, store)
+    return num
+
+
+def _limit_concurrent_requests(cat, max_requests):
+    """Limit the number of simultaneous requests made to Geoserver via *cat*."""
+    semaphore = threading.BoundedSemaphore(max_requests)
+    http_request = cat.http_request
+
+    def _http_request(*args, **kwargs):
+        with semaphore:
+            return http_request(*args, **kwargs)
+
+    cat.http_request = _http_request
+
+
+def _clean_store(config, cat, store, now, deleter, high_water_marks=None):
+    """Clean a store, and return the store name, number of deleted granules and the elapsed time."""
+    start_time = time.time()
+    rule = utils.get_retention_rule(config, store)
+    since = None if high_water_marks is None else high_water_marks.get(store)
+    max_age = None
+    try:
+        if rule.get("max_count") or rule.get("thin_interval"):
+            num = _delete_granules_by_rule(config, cat, store, now, rule, deleter)
+        else:
+            max_age = now - dt.timedelta(minutes=rule["max_age"])
+            num = _delete_old_granules_from_store(config, cat, store, max_age, deleter, since=since)
+    except Exception:
+        logger.exception("Cleaning of '%s' failed", store)
+        num = None
+    else:
+        if high_water_marks is not None and max_age is not None:
+            # Everything older than the cutoff is now gone
+            high_water_marks[store] = max_age
+    return store, num, time.time() - start_time
+
+
+def _log_cleanup_summary(results):
+    for store, num, elapsed in sorted(results, key=lambda res: res[2], reverse=True):
+        if num is None:
+            logger.info("%s: failed after %.1f s", store, elapsed)
+        else:
+            logger.info("%s: %d granule(s) deleted in %.1f s", store, num, elapsed)
+
+
+def _delete_old_granules_from_store(config, cat, store, max_age, deleter, since=None):
+    workspace = config["workspace"]
+    cql_filter = utils.cql_time_before(max_age, start_time=since)
+    store_obj = cat.get_store(store, workspace)
+    logger.debug("Getting coverage for %s", store)
+    coverage = get_layer_coverage(cat, store, store_obj)
+    logger.debug("Getting granules for %s", store)
+    granules = iter_layer_granules(cat, coverage, store_obj, cql_filter=cql_filter)
+    # Collect the expired granules before deleting them, deleting changes the paging offsets
+    cutoff = utils.time_key(max_age)
+    expired = [_strip_granule(granule) for granule in granules
+               if utils.time_key(granule["properties"]["time"]) < cutoff]
+    if config.get("bulk_delete", False):
+        if expired:
+            delete_granules(cat, coverage, store_obj, cql_filter)
+            logger.info("%d granule(s) removed from %s:%s", len(expired), workspace, store)
+        _delete_expired_files(config, expired, deleter)
+    else:
+        _delete_expired_granules(config, cat, store, store_obj, expired, deleter)
+    return len(expired)
+
+
+def _delete_granules_by_rule(config, cat, store, now, rule, deleter):
+    """Delete the granules of *store* selected by the retention *rule*."""
+    workspace = config["workspace"]
+    store_obj = cat.get_store(store, workspace)
+    coverage = get_layer_coverage(cat, store, store_obj)
+    granules = [_strip_granule(granule) for granule in iter_layer_granules(cat, coverage, store_obj)]
+    times = [granule["properties"]["time"] for granule in granules]
+    expired = [granules[i] for i in utils.select_expired_granules(times, now, **rule)]
+    _delete_expired_granules(config, cat, store, store_obj, expired, deleter)
+    return len(expired)
+
+
+def _delete_expired_granules(config, cat, store, store_obj, expired, deleter):
+    for granule in expired:
+        _delete_id_from_gs(cat, config["workspace"], store, store_obj, granule)
+    _delete_expired_files(config, expired, deleter)
+
+
+def _delete_expired_files(config, expired, deleter):
+    if deleter is not None:
+        for granule in expired:
+            _delete_files_from_fs(config, granule["properties"]["location"], deleter)
+
+
+def _strip_granule(granule):
+    """Keep only the granule ID, location and time."""
+    properties = granule["properties"]
+    return {"id": granule["id"],
+            "properties": {"location": properties["location"], "time": properties["time"]}}
+
+
+def reconcile_layers(config):
+    """Reconcile the files in the layer directories with the granules of the layers.
+
+    Files matching 'file_pattern' that are not in the layer are added to it, or
+    deleted if 'orphan_files' is set to 'delete'.  Granules whose file is
+    missing are removed from the layer, unless 'missing_files' is set to 'ignore'.
+    Granules outside 'geoserver_target_dir' are left as they are.  Layers
+    sharing a directory need 'layer_name_template' to tell their files apart.
+
+    If 'reconcile_state_file' is given, the modification times of the layer
+    directories are saved to it, and unchanged directories are skipped on the
+    following runs.
+
+    """
+    if not config.get("create_subdirectories", True) and "layer_name_template" not in config:
+        logger.error("Layers sharing a directory can't be reconciled without 'layer_name_template'")
+        return
     cat = connect_to_gs_catalog(config)
+    state_file = config.get("reconcile_state_file")
+    state = utils.read_json_state(state_file) if state_file else {}
+
+    for store, directory in utils.get_exposed_layer_directories(config).items():
+        try:
+            mtime = os.stat(directory).st_mtime
+        except FileNotFoundError:
+            logger.warning("Directory %s for layer '%s' doesn't exist", directory, store)
+            continue
+        if state.get(store, {}).get("mtime") == mtime:
+            logger.debug("No changes in %s since the previous run", directory)
+            continue
+        _reconcile_layer(config, cat, store, directory)
+        state[store] = {"mtime": mtime}
+        if state_file:
+            utils.write_json_state(state_file, state)
+
+
+def _reconcile_layer(config, cat, store, directory):
     workspace = config["workspace"]
-    max_age = dt.datetime.utcnow() - dt.timedelta(minutes=config["max_age"])
+    files = _get_layer_files(config, store, directory)
+
+    store_obj = cat.get_store(store, workspace)
+    coverage = get_layer_coverage(cat, store, store_obj)
+    granules = {}
+    missing = []
+    for granule in iter_layer_granules(cat, coverage, store_obj):
+        location = granule["properties"]["location"]
+        if not _is_in_directory(location, config["geoserver_target_dir"]):
+            logger.debug("Granule '%s' is not under 'geoserver_target_dir', skipping", location)
+            continue
+        fs_path = utils.convert_file_path(config, location, inverse=True, keep_subpath=True)
+        granules[fs_path] = granule["id"]
+        if os.path.dirname(fs_path) == directory:
+            exists = fs_path in files
+        else:
+            exists = os.path.exists(fs_path)
+        if not exists:
+            missing.append((fs_path, granule["id"]))
+    orphans = sorted(files - granules.keys())
+    logger.info("Layer '%s': %d file(s) not in the layer, %d granule(s) without a file",
+                store, len(orphans), len(missing))
+
+    orphan_action = config.get("orphan_files", "add")
+    for fs_path in orphans:
+        if orphan_action == "add":
+            gs_path = os.path.join(config["geoserver_target_dir"], os.path.relpath(fs_path, config["exposed_base_dir"]))
+            add_granule(cat, workspace, store, gs_path)
+        elif orphan_action == "delete":
+            _delete_orphan_file(fs_path)
+    if config.get("missing_files", "delete") == "delete":
+        for fs_path, id_ in missing:
+            cat.delete_granule(coverage['name'], store_obj, id_, workspace)
+            logger.info("Granule '%s' without a file removed from %s:%s",
+                        os.path.basename(fs_path), workspace, store)
+
+
+def _is_in_directory(path, directory):
+    directory = os.path.normpath(directory)
+    return os.path.commonpath([os.path.normpath(path), directory]) == directory
+
+
+def _get_layer_files(config, store, directory):
+    """Get the files in *directory* that belong to the layer *store*."""
+    router = utils.get_filename_router(config)
+    # Layers sharing a directory are separated with the layer name template
+    check_store = not config.get("create_subdirectories", True)
+    files = set()
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name.endswith(".prj"):
+                continue
+            try:
+                if check_store and router.get_store(entry.name) != store:
+                    continue
+                router.parse(entry.name)
+            except (ValueError, KeyError):
+                continue
+            files.add(entry.path)
+    return files
 
-    for store in utils.get_layers_for_delete_granules(config):
-        store_obj = cat.get_store(store, workspace)
-        logger.debug("Getting coverage for %s", store)
-        coverage = get_layer_coverage(cat, store, store_obj)
-        logger.debug("Getting granules for %s", store)
-        granules = get_layer_granules(cat, coverage, store_obj)
-        for granule in granules['features']:
-            tim = dt.datetime.strptime(granule["properties"]["time"], LAYER_TIME_FORMAT)
-            if tim.replace(tzinfo=None) < max_age:
-                _delete_id_from_gs(cat, workspace, store, store_obj, granule)
-                _delete_files_from_fs(config, granule["properties"]["location"])
+
+def _delete_orphan_file(fs_path):
+    for path in (fs_path, os.path.splitext(fs_path)[0] + ".prj"):
+        try:
+            os.remove(path)
+            logger.info("File %s deleted", path)
+        except FileNotFoundError:
+            pass
+
+
+def delete_granules(cat, coverage, store_obj, cql_filter):
+    """Delete all the granules matching *cql_filter* from a layer with a single request.
+
+    The files are not removed.
+    """
+    url = build_url(cat.service_url,
+                    ["workspaces", store_obj.workspace.name, "coveragestores", store_obj.name,
+                     "coverages", coverage['name'], "index/granules.json"],
+                    {"filter": cql_filter})
+    headers = {"Content-type": "application/json", "Accept": "application/json"}
+    resp = cat.http_request(url, method="delete", headers=headers)
+    if resp.status_code != 200:
+        raise FailedRequestError(
+            f"Failed to delete granules from mosaic {store_obj.name}: {resp.status_code}, {resp.text}")
 
 
 def _delete_id_from_gs(cat, workspace, store, store_obj, granule):
@@ -441,20 +1183,7 @@ def _delete_id_from_gs(cat, workspace, store, store_obj, granule):
     logger.info("Granule '%s' removed from %s:%s", fname, workspace, store)
 
 
-def _delete_files_from_fs(config, gs_location):
-    delete_files = config.get("delete_files", False)
-    if not delete_files:
-        return
+def _delete_files_from_fs(config, gs_location, deleter):
     fs_path = utils.convert_file_path(config, gs_location, inverse=True, keep_subpath=config.get("keep_subpath", False))
-    _delete_file_from_fs(config, fs_path)
-    _delete_file_from_fs(config, fs_path, replace_extension="prj")
-
-
-def _delete_file_from_fs(config, fs_path, replace_extension=None):
-    if replace_extension:
-        fs_path = os.path.splitext(fs_path)[0] + "." + replace_extension
-    if os.path.exists(fs_path):
-        os.remove(fs_path)
-        logger.info("File %s deleted", fs_path)
-    elif replace_extension is None:
-        logger.warning("File %s not available on filesystem", fs_path)
+    deleter.delete(fs_path)
+    deleter.delete(os.path.splitext(fs_path)[0] + ".prj", warn_missing=False)
@@ -4,13 +4,17 @@
 #
 #     Panu Lahtinen <panu.lahtinen@fmi.fi>
 
-"""Add a file (granule) to a Geoserver ImageMosaic layer via REST API."""
+"""Add files (granules) to Geoserver ImageMosaic layers via REST API.
+
+The files can be given as arguments or glob patterns, read from a manifest
+file given as '@filename', or from stdin with '-'.
+"""
 
 import logging
 import sys
 
-from georest import add_file_to_mosaic
-from georest.utils import read_config
+from georest import add_file_to_mosaic, add_files_to_mosaics
+from georest.utils import read_config, read_filenames
 
 
 def run():
@@ -20,4 +24,8 @@ def run():
     if "log_config" in config:
         logging.config.dictConfig(config["log_config"])
 
-    add_file_to_mosaic(config, sys.argv[2])
+    fnames = read_filenames(sys.argv[2:])
+    if len(fnames) == 1:
+        add_file_to_mosaic(config, fnames[0])
+    else:
+        add_files_to_mosaics(config, fnames)
@@ -4,13 +4,17 @@
 #
 #     Panu Lahtinen <panu.lahtinen@fmi.fi>
 
-"""Delete a grenule from Geoserver ImageMosaic layer via REST API."""
+"""Delete granules from Geoserver ImageMosaic layers via REST API.
+
+The files to delete can be given as arguments, read from a file given as
+'@filename', or from stdin with '-'.
+"""
 
 import logging
 import sys
 
-from georest import delete_file_from_mosaic
-from georest.utils import read_config
+from georest import delete_file_from_mosaic, delete_files_from_mosaics
+from georest.utils import read_config, read_filenames
 
 
 def run():
@@ -20,5 +24,8 @@ def run():
     if "log_config" in config:
         logging.config.dictConfig(config["log_config"])
 
-    fname = sys.argv[2]
-    delete_file_from_mosaic(config, fname)
+    fnames = read_filenames(sys.argv[2:])
+    if len(fnames) == 1:
+        delete_file_from_mosaic(config, fnames[0])
+    else:
+        delete_files_from_mosaics(config, fnames)
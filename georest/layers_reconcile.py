@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+#
+# Author(s):
+#
+#     Panu Lahtinen <panu.lahtinen@fmi.fi>
+
+"""Reconcile the files in the layer directories with the Geoserver ImageMosaic granules."""
+
+import logging
+import sys
+import time
+
+from georest import reconcile_layers
+from georest.utils import read_config
+
+
+def run():
+    """Reconcile layers."""
+    config = read_config(sys.argv[1])
+
+    if "log_config" in config:
+        logging.config.dictConfig(config["log_config"])
+
+    logger = logging.getLogger("reconcile_layers")
+    start_time = time.time()
+    reconcile_layers(config)
+    logger.info("Reconciliation for %s completed in %.1f s",
+                sys.argv[1], (time.time() - start_time))
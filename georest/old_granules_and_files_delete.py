@@ -10,7 +10,7 @@ import logging
 import sys
 import time
 
-from georest import delete_old_files_from_mosaics_and_fs
+from georest import delete_old_files_from_mosaics_and_fs, run_cleanup_daemon
 from georest.utils import read_config
 
 
@@ -22,6 +22,10 @@ def run():
         logging.config.dictConfig(config["log_config"])
 
     logger = logging.getLogger("delete_old_granules_and_files")
+    if "cleanup_interval" in config:
+        logger.info("Cleaning daemon started")
+        run_cleanup_daemon(config)
+        return
     start_time = time.time()
     delete_old_files_from_mosaics_and_fs(config)
     logger.info("Cleaning for %s completed in %.1f s",
@@ -10,16 +10,23 @@
 from copy import deepcopy
 from unittest import mock, TestCase
 
+import pytest
+
 
 @mock.patch("georest.Catalog")
 def test_connect_to_gs_catalog(Catalog):
     """Test connecting Geoserver catalog."""
     from georest import connect_to_gs_catalog
+    from georest.utils import CachingCatalog
 
     config = {"host": "foo", "user": "user", "passwd": "passwd"}
-    _ = connect_to_gs_catalog(config)
+    cat = connect_to_gs_catalog(config)
 
     Catalog.assert_called_with(config["host"], config["user"], config["passwd"])
+    assert isinstance(cat, CachingCatalog)
+
+    config["catalog_cache_ttl"] = 0
+    assert connect_to_gs_catalog(config) is Catalog.return_value
 
 
 def test_create_workspace():
@@ -253,6 +260,87 @@ def test_create_layers_creation_fails(connect_to_gs_catalog, DimensionInfo):
     cat.create_imagemosaic.assert_called()
 
 
+@mock.patch("georest.DimensionInfo")
+@mock.patch("georest.connect_to_gs_catalog")
+def test_create_layers_parallel(connect_to_gs_catalog, DimensionInfo, caplog):
+    """Test creating layers in parallel."""
+    import logging
+    import os
+    import tempfile
+
+    from georest import create_layers
+
+    config = deepcopy(CREATE_LAYERS_CONFIG)
+    config["create_workers"] = 3
+    config["layers"] = [{"name": f"layer_{i}"} for i in range(5)]
+    cat = mock.MagicMock()
+    cat.get_store.return_value = None
+    cat.create_imagemosaic.side_effect = _fail_for_layer_2
+    connect_to_gs_catalog.return_value = cat
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        config["exposed_base_dir"] = tempdir
+        for layer in config["layers"]:
+            os.mkdir(os.path.join(tempdir, layer["name"]))
+        with caplog.at_level(logging.INFO):
+            create_layers(config.copy())
+
+    # The workspace is handled only once
+    cat.get_workspace.assert_called_once_with(config["workspace"])
+    assert cat.create_imagemosaic.call_count == 5
+    assert cat.save.call_count == 4
+    assert "layer_2: failed after" in caplog.text
+    assert "layer_4: done in" in caplog.text
+    assert "4 of 5 layer(s) created or updated" in caplog.text
+
+
+def test_add_layer_metadata_unchanged():
+    """Test that layers that are up to date are not saved."""
+    import xml.etree.ElementTree as ET
+
+    from geoserver.support import DimensionInfo
+
+    from georest import add_layer_metadata
+
+    config = deepcopy(CREATE_LAYERS_CONFIG)
+    meta = {"title": "Title text", "abstract": "Abstract", "keywords": ["kw1", "kw2"],
+            "cache_age_max": 86400, "projection_policy": "FORCE_DECLARED"}
+    style = {"default_style": {"name": "style", "workspace": "workspace"},
+             "additional_styles": [{"name": "additional_style1"}]}
+    dim = config["dimensions"]["time_dimension"]
+    dim["enabled"] = True
+    dim["resolution"] = "15 minutes"
+    dim["nearestMatchEnabled"] = False
+    coverage = mock.MagicMock(title="Title text", abstract="Abstract", keywords=["kw1", "kw2"],
+                              projection_policy="FORCE_DECLARED")
+    coverage.metadata = {
+        "name": DimensionInfo("name", True, "presentation", 900000, "units", None,
+                              nearestMatchEnabled="false"),
+        "cacheAgeMax": "86400",
+        "cachingEnabled": "true"}
+    cat = mock.MagicMock()
+    cat.get_resource.return_value = coverage
+    cat.get_layer.return_value.dom = ET.fromstring(
+        "<layer><defaultStyle><name>workspace:style</name></defaultStyle>"
+        "<styles><style><name>additional_style1</name></style></styles></layer>")
+
+    assert add_layer_metadata(cat, "workspace", "layer", config["dimensions"], meta, style=style)
+    cat.save.assert_not_called()
+
+    # Only the changed layer attributes are saved
+    meta["title"] = "New title"
+    add_layer_metadata(cat, "workspace", "layer", config["dimensions"], meta, style=style)
+    cat.save.assert_called_once_with(coverage)
+    assert coverage.title == "New title"
+    assert coverage.metadata["name"].resolution == 900000
+    cat.get_style.assert_not_called()
+
+
+def _fail_for_layer_2(layer, *args, **kwargs):
+    if layer == "layer_2":
+        raise ValueError("Failed")
+
+
 def test_get_layer_coverage():
     """Test retrieving layer coverage."""
     from georest import get_layer_coverage
@@ -275,6 +363,29 @@ def test_get_layer_coverage():
     assert res == coverages["coverages"]["coverage"][1]
 
 
+def test_iter_layer_granules():
+    """Test iterating over layer granules in pages."""
+    from georest import iter_layer_granules
+
+    features = [{"id": f"id{i}", "properties": {"location": f"/mnt/data/file{i}.tif"}} for i in range(5)]
+    cat = mock.MagicMock()
+    cat.list_granules.side_effect = lambda coverage, store, filter, limit, offset: {
+        "features": features[offset:offset + limit]}
+    coverage = {"name": "airmass_store"}
+    store_obj = mock.MagicMock()
+
+    res = list(iter_layer_granules(cat, coverage, store_obj, cql_filter="filter", page_size=2))
+    assert res == features
+    assert cat.list_granules.call_count == 3
+    cat.list_granules.assert_called_with("airmass_store", store_obj, filter="filter", limit=2, offset=4)
+
+    # The pages are requested only when needed
+    cat.list_granules.reset_mock()
+    granules = iter_layer_granules(cat, coverage, store_obj, page_size=2)
+    assert next(granules) == features[0]
+    cat.list_granules.assert_called_once()
+
+
 ADD_FILE_TO_MOSAIC_CONFIG = {
     "host": "http://host/",
     "user": "user",
@@ -375,6 +486,217 @@ def test_add_file_to_mosaic_existing_file(connect_to_gs_catalog, file_in_granule
     add_granule.assert_not_called()
 
 
+@mock.patch("georest.connect_to_gs_catalog")
+def test_add_files_to_mosaics(connect_to_gs_catalog):
+    """Test adding several files to image mosaics."""
+    from georest import add_files_to_mosaics
+
+    cat = mock.MagicMock()
+    cat.mosaic_coverages.side_effect = lambda store_obj: {"coverages": {"coverage": [{"name": store_obj.name}]}}
+    cat.get_store.side_effect = lambda store, workspace: _create_store_obj(store)
+    cat.list_granules.return_value = {"features": [
+        {"properties": {"location": "/mnt/data/20200812_0900_europe_airmass.tif"}, "id": "existing"}]}
+    connect_to_gs_catalog.return_value = cat
+
+    config = {"workspace": "satellite",
+              "geoserver_target_dir": "/mnt/data",
+              "file_pattern": "{start_time:%Y%m%d_%H%M}_{area}_{productname}.tif",
+              "identity_check_seconds": 60,
+              "layer_id": "productname",
+              "layers": {"airmass": "airmass_store", "ash": "ash_store"}}
+    fnames = ["/path/to/20200812_0900_europe_airmass.tif", "/path/to/20200812_0900_europe_ash.tif",
+              "/path/to/20200812_0915_europe_airmass.tif", "/path/to/20200812_0915_europe_airmass.tif",
+              "/path/to/20200812_0915_europe_unknown.tif", "/path/to/not_matching.tif"]
+
+    with mock.patch("georest.add_granule", return_value=True) as add_granule:
+        assert add_files_to_mosaics(config, fnames) == 2
+
+    connect_to_gs_catalog.assert_called_once_with(config)
+    # One listing per store for the duplicate check
+    assert cat.list_granules.call_count == 2
+    added = [call.args[2:] for call in add_granule.call_args_list]
+    assert added == [("airmass_store", "/mnt/data/20200812_0915_europe_airmass.tif"),
+                     ("ash_store", "/mnt/data/20200812_0900_europe_ash.tif")]
+
+
+@mock.patch("georest.requests")
+@mock.patch("georest.connect_to_gs_catalog")
+def test_add_files_to_mosaics_defer_recalculation(connect_to_gs_catalog, requests):
+    """Test that the coverage is recalculated once per store after the granules have been added."""
+    from georest import add_files_to_mosaics
+
+    cat = mock.MagicMock()
+    cat.mosaic_coverages.return_value = {"coverages": {"coverage": [{"name": "airmass_store"}]}}
+    connect_to_gs_catalog.return_value = cat
+    session = requests.Session.return_value
+    session.post.return_value.status_code = requests.codes.accepted
+    requests.put.return_value.status_code = requests.codes.ok
+
+    # The host is given without the trailing slash
+    config = {"host": "http://host/geoserver/rest",
+              "user": "user",
+              "passwd": "passwd",
+              "workspace": "satellite",
+              "geoserver_target_dir": "/mnt/data",
+              "file_pattern": "{area}_{productname}.tif",
+              "defer_recalculation": True,
+              "layer_id": "productname",
+              "layers": {"airmass": "airmass_store"}}
+
+    assert add_files_to_mosaics(config, ["europe_airmass.tif", "global_airmass.tif"]) == 2
+
+    cat.add_granule.assert_not_called()
+    assert session.post.call_count == 2
+    call = session.post.call_args
+    assert call.args[0] == "http://host/geoserver/rest/workspaces/satellite/coveragestores/airmass_store/" \
+                           "external.imagemosaic"
+    assert call.kwargs["data"] == "file:/mnt/data/global_airmass.tif"
+    assert call.kwargs["params"] == {"configure": "none", "updateBBox": "false"}
+    requests.put.assert_called_once()
+    assert requests.put.call_args.args[0] == (
+        "http://host/geoserver/rest/workspaces/satellite/coveragestores/airmass_store/coverages/"
+        "airmass_store.xml?recalculate=nativebbox,latlonbbox")
+
+
+@mock.patch("georest.requests", None)
+@mock.patch("georest.connect_to_gs_catalog")
+def test_add_files_to_mosaics_defer_recalculation_without_requests(connect_to_gs_catalog):
+    """Test that a clear error is raised when 'requests' is needed but not installed."""
+    from georest import add_files_to_mosaics
+
+    config = {"workspace": "satellite",
+              "geoserver_target_dir": "/mnt/data",
+              "file_pattern": "{area}_{productname}.tif",
+              "defer_recalculation": True,
+              "layer_id": "productname",
+              "layers": {"airmass": "airmass_store"}}
+
+    with pytest.raises(ImportError, match="requests"):
+        add_files_to_mosaics(config, ["europe_airmass.tif"])
+
+
+@mock.patch("georest.connect_to_gs_catalog")
+def test_add_files_to_mosaics_bulk_harvest(connect_to_gs_catalog, tmp_path, monkeypatch):
+    """Test adding new directories to image mosaics with a single request."""
+    import os
+
+    from georest import add_files_to_mosaics
+
+    cat = mock.MagicMock()
+    cat.mosaic_coverages.return_value = {"coverages": {"coverage": [{"name": "airmass_store"}]}}
+    cat.list_granules.return_value = {"features": [
+        {"properties": {"location": "/mnt/data/old/20200812_0900_europe_airmass.tif"}, "id": "existing"}]}
+    connect_to_gs_catalog.return_value = cat
+
+    config = {"workspace": "satellite",
+              "geoserver_target_dir": "/mnt/data",
+              "keep_subpath": True,
+              "bulk_harvest": True,
+              "file_pattern": "{start_time:%Y%m%d_%H%M}_{area}_{productname}.tif",
+              "identity_check_seconds": 60,
+              "layer_id": "productname",
+              "layers": {"airmass": "airmass_store"}}
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("new")
+    os.mkdir("old")
+    new_files = _create_extra_files("new", ["20200813_0900_europe_airmass.tif",
+                                            "20200813_0915_europe_airmass.tif"])
+    old_files = _create_extra_files("old", ["20200812_0900_europe_airmass.tif",
+                                            "20200812_0915_europe_airmass.tif"])
+
+    assert add_files_to_mosaics(config, new_files + old_files) == 3
+
+    added = [call.args[0] for call in cat.add_granule.call_args_list]
+    # The new directory is harvested, and the new file in the other directory is added separately
+    assert added == ["/mnt/data/new", "/mnt/data/old/20200812_0915_europe_airmass.tif"]
+
+    # Any other file in the directory would be harvested too
+    cat.add_granule.reset_mock()
+    os.mkdir("stray")
+    stray_files = _create_extra_files("stray", ["20200814_0900_europe_airmass.tif",
+                                                "20200814_0915_europe_airmass.tif"])
+    _create_extra_files("stray", ["foo.tif"])
+    assert add_files_to_mosaics(config, stray_files) == 2
+    assert [call.args[0] for call in cat.add_granule.call_args_list] == [
+        "/mnt/data/stray/20200814_0900_europe_airmass.tif", "/mnt/data/stray/20200814_0915_europe_airmass.tif"]
+
+    # Without subpaths the files are flattened, so the directory can't be harvested
+    cat.add_granule.reset_mock()
+    config["keep_subpath"] = False
+    cat.list_granules.return_value = {"features": []}
+    assert add_files_to_mosaics(config, new_files) == 2
+    added = [call.args[0] for call in cat.add_granule.call_args_list]
+    assert added == ["/mnt/data/20200813_0900_europe_airmass.tif", "/mnt/data/20200813_0915_europe_airmass.tif"]
+
+    # Bare filenames are in the current directory
+    cat.add_granule.reset_mock()
+    config["keep_subpath"] = True
+    monkeypatch.chdir("new")
+    assert add_files_to_mosaics(config, [os.path.basename(fname) for fname in new_files]) == 2
+    assert [call.args[0] for call in cat.add_granule.call_args_list] == ["/mnt/data"]
+
+
+@mock.patch("georest.evict_old_granules")
+@mock.patch("georest.utils.file_in_granules")
+@mock.patch("georest.connect_to_gs_catalog")
+def test_add_file_to_mosaic_evict_on_add(connect_to_gs_catalog, file_in_granules, evict_old_granules):
+    """Test evicting old granules after adding a file to image mosaic."""
+    from georest import add_file_to_mosaic
+
+    config = deepcopy(ADD_FILE_TO_MOSAIC_CONFIG)
+    config["evict_on_add"] = True
+    file_in_granules.return_value = False
+    cat = mock.MagicMock()
+    connect_to_gs_catalog.return_value = cat
+
+    add_file_to_mosaic(config, "/path/to/europe_airmass.tif")
+    evict_old_granules.assert_called_once_with(config, cat, "airmass_store")
+
+
+@mock.patch("georest.connect_to_gs_catalog")
+def test_evict_old_granules(connect_to_gs_catalog):
+    """Test evicting old granules from a store."""
+    import datetime as dt
+    import os
+    import tempfile
+
+    from georest import evict_old_granules
+
+    cat = mock.MagicMock()
+    cat.mosaic_coverages.return_value = {"coverages": {"coverage": [{"name": "airmass_store"}]}}
+    old_time = (dt.datetime.utcnow() - dt.timedelta(hours=2)).strftime("%Y-%m-%dT%H:%M:%S.000+0000")
+    cat.list_granules.return_value = {"features": [
+        {"properties": {"location": "/mnt/data/old.tif", "time": old_time}, "id": "old-id"}]}
+    config = {"workspace": "satellite", "max_age": 60}
+
+    assert evict_old_granules(config, cat, "airmass_store") == 1
+    cat.delete_granule.assert_called_once_with("airmass_store", cat.get_store.return_value,
+                                               "old-id", "satellite")
+    # Only the expired granules are requested
+    assert "time <" in cat.list_granules.call_args.kwargs["filter"]
+
+    # The files of the evicted granules are deleted directly
+    with tempfile.TemporaryDirectory() as tempdir:
+        config.update({"delete_files": True, "geoserver_target_dir": "/mnt/data", "exposed_base_dir": tempdir})
+        old_file = os.path.join(tempdir, "old.tif")
+        open(old_file, "w").close()
+        with mock.patch("georest.utils.FileDeleter") as FileDeleter:
+            assert evict_old_granules(config, cat, "airmass_store") == 1
+        FileDeleter.assert_not_called()
+        assert not os.path.exists(old_file)
+
+    # Count and thinning rules are left for the periodic cleanup
+    cat.list_granules.reset_mock()
+    config["retention_rules"] = {"airmass_store": {"max_age": None, "max_count": 10}}
+    assert evict_old_granules(config, cat, "airmass_store") == 0
+    cat.list_granules.assert_not_called()
+    del config["retention_rules"]
+
+    # Errors are not raised
+    cat.list_granules.side_effect = ValueError
+    assert evict_old_granules(config, cat, "airmass_store") is None
+
+
 @mock.patch("georest.connect_to_gs_catalog")
 def test_add_file_to_mosaic_failed_request(connect_to_gs_catalog):
     """Test that a failed file addition is handled."""
@@ -467,7 +789,9 @@ def test_delete_file_from_mosaic(connect_to_gs_catalog):
 
     connect_to_gs_catalog.assert_called_with(config)
     cat.get_store.assert_called_with("airmass_store", "satellite")
-    cat.list_granules.assert_called()
+    cat.list_granules.assert_called_with("airmass_store", cat.get_store.return_value,
+                                         filter="location LIKE '%europe_airmass.tif%'",
+                                         limit=1000, offset=0)
     cat.delete_granule.assert_not_called()
 
     # This is the structure returned by cat.list_granules()
@@ -527,6 +851,247 @@ def test_delete_file_from_mosaic_layertemplate(connect_to_gs_catalog):
     cat.delete_granule.assert_called()
 
 
+@mock.patch("georest.connect_to_gs_catalog")
+def test_delete_files_from_mosaics(connect_to_gs_catalog):
+    """Test deleting several files from image mosaics."""
+    from georest import delete_files_from_mosaics
+
+    cat = mock.MagicMock()
+    cat.mosaic_coverages.side_effect = lambda store_obj: {"coverages": {"coverage": [{"name": store_obj.name}]}}
+    cat.get_store.side_effect = lambda store, workspace: _create_store_obj(store)
+    cat.list_granules.side_effect = lambda coverage, store_obj, **kwargs: {"features": [
+        {"properties": {"location": f"/mnt/data/{area}_{coverage.split('_')[0]}.tif"}, "id": f"{coverage}.{area}"}
+        for area in ["europe", "global"]]}
+    connect_to_gs_catalog.return_value = cat
+
+    config = {"workspace": "satellite",
+              "file_pattern": "{area}_{productname}.tif",
+              "layer_id": "productname",
+              "layers": {"airmass": "airmass_store", "ash": "ash_store"}}
+    fnames = ["/path/to/europe_airmass.tif", "global_airmass.tif", "europe_ash.tif", "arctic_ash.tif",
+              "europe_unknown.tif", "not_matching.png"]
+
+    delete_files_from_mosaics(config, fnames)
+
+    connect_to_gs_catalog.assert_called_once_with(config)
+    assert cat.list_granules.call_count == 2
+    deleted = [call.args[2] for call in cat.delete_granule.call_args_list]
+    assert deleted == ["airmass_store.europe", "airmass_store.global", "ash_store.europe"]
+
+
+@mock.patch("georest.connect_to_gs_catalog")
+def test_delete_old_files_from_mosaics_and_fs(connect_to_gs_catalog):
+    """Test deleting old granules from image mosaics and filesystem."""
+    import datetime as dt
+    import os
+    import tempfile
+
+    from georest import delete_old_files_from_mosaics_and_fs
+
+    coverages = {"coverages": {"coverage": [{"name": "airmass_store"}]}}
+    cat = mock.MagicMock()
+    cat.mosaic_coverages.return_value = coverages
+    connect_to_gs_catalog.return_value = cat
+    old_time = dt.datetime.utcnow() - dt.timedelta(hours=2)
+    granules = {"features": [
+        {"properties": {"location": "/mnt/data/old.tif",
+                        "time": old_time.strftime("%Y-%m-%dT%H:%M:%S.000+0000")},
+         "id": "old-id"}]}
+    cat.list_granules.return_value = granules
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        config = {"workspace": "satellite",
+                  "geoserver_target_dir": "/mnt/data",
+                  "exposed_base_dir": tempdir,
+                  "delete_files": True,
+                  "max_age": 60,
+                  "layer_id": "productname",
+                  "layers": {"airmass": "airmass_store"}}
+        fs_files = _create_extra_files(tempdir, ["old.tif", "old.prj"])
+
+        delete_old_files_from_mosaics_and_fs(config)
+
+        cql_filter = cat.list_granules.call_args.kwargs["filter"]
+        assert cql_filter.startswith("time < '")
+        cat.delete_granule.assert_called_once_with("airmass_store", cat.get_store.return_value,
+                                                   "old-id", "satellite")
+        for fname in fs_files:
+            assert not os.path.exists(fname)
+
+
+@mock.patch("georest.connect_to_gs_catalog")
+def test_delete_old_files_from_mosaics_and_fs_bulk(connect_to_gs_catalog):
+    """Test deleting old granules from image mosaics with a single request."""
+    import datetime as dt
+
+    from georest import delete_old_files_from_mosaics_and_fs
+
+    coverages = {"coverages": {"coverage": [{"name": "airmass_store"}]}}
+    cat = mock.MagicMock(service_url="http://host/geoserver/rest")
+    cat.mosaic_coverages.return_value = coverages
+    cat.http_request.return_value.status_code = 200
+    store_obj = cat.get_store.return_value
+    store_obj.name = "airmass_store"
+    store_obj.workspace.name = "satellite"
+    connect_to_gs_catalog.return_value = cat
+    old_time = (dt.datetime.utcnow() - dt.timedelta(hours=2)).strftime("%Y-%m-%dT%H:%M:%S.000+0000")
+    cat.list_granules.return_value = {"features": [
+        {"properties": {"location": f"/mnt/data/old{i}.tif", "time": old_time}, "id": f"id{i}"}
+        for i in range(3)]}
+
+    config = {"workspace": "satellite",
+              "max_age": 60,
+              "bulk_delete": True,
+              "layer_id": "productname",
+              "layers": {"airmass": "airmass_store"}}
+    delete_old_files_from_mosaics_and_fs(config)
+
+    cat.delete_granule.assert_not_called()
+    cat.http_request.assert_called_once()
+    url = cat.http_request.call_args.args[0]
+    assert url.startswith("http://host/geoserver/rest/workspaces/satellite/coveragestores/airmass_store/"
+                          "coverages/airmass_store/index/granules.json?filter=time+%3C+")
+    assert cat.http_request.call_args.kwargs["method"] == "delete"
+
+    # No request if there's nothing to delete
+    cat.http_request.reset_mock()
+    cat.list_granules.return_value = {"features": []}
+    delete_old_files_from_mosaics_and_fs(config)
+    cat.http_request.assert_not_called()
+
+
+@mock.patch("georest.connect_to_gs_catalog")
+def test_delete_old_files_from_mosaics_and_fs_high_water_marks(connect_to_gs_catalog):
+    """Test that only granules newer than the high-water mark are requested."""
+    from georest import delete_old_files_from_mosaics_and_fs
+
+    cat = mock.MagicMock()
+    cat.mosaic_coverages.return_value = {"coverages": {"coverage": [{"name": "airmass_store"}]}}
+    cat.list_granules.return_value = {"features": []}
+    connect_to_gs_catalog.return_value = cat
+    config = {"workspace": "satellite",
+              "max_age": 60,
+              "layer_id": "productname",
+              "layers": {"airmass": "airmass_store"}}
+
+    high_water_marks = {}
+    delete_old_files_from_mosaics_and_fs(config, high_water_marks=high_water_marks)
+    assert cat.list_granules.call_args.kwargs["filter"].startswith("time < '")
+    assert "airmass_store" in high_water_marks
+
+    delete_old_files_from_mosaics_and_fs(config, high_water_marks=high_water_marks)
+    assert cat.list_granules.call_args.kwargs["filter"].startswith("time >= '")
+
+    # Failed stores are checked fully on the next pass
+    cat.list_granules.side_effect = ValueError
+    high_water_marks = {}
+    delete_old_files_from_mosaics_and_fs(config, high_water_marks=high_water_marks)
+    assert high_water_marks == {}
+
+
+@mock.patch("georest.connect_to_gs_catalog")
+def test_delete_old_files_from_mosaics_and_fs_retention_rules(connect_to_gs_catalog):
+    """Test deleting granules with layer specific retention rules."""
+    import datetime as dt
+
+    from georest import delete_old_files_from_mosaics_and_fs
+
+    cat = mock.MagicMock()
+    cat.mosaic_coverages.return_value = {"coverages": {"coverage": [{"name": "airmass_store"}]}}
+    now = dt.datetime.utcnow()
+    cat.list_granules.return_value = {"features": [
+        {"properties": {"location": f"/mnt/data/{i}.tif",
+                        "time": (now - dt.timedelta(minutes=i)).strftime("%Y-%m-%dT%H:%M:%S.000+0000")},
+         "id": f"id{i}"}
+        for i in range(5)]}
+    connect_to_gs_catalog.return_value = cat
+    config = {"workspace": "satellite",
+              "max_age": 60,
+              "retention_rules": {"airmass_store": {"max_count": 2}},
+              "layer_id": "productname",
+              "layers": {"airmass": "airmass_store"}}
+
+    delete_old_files_from_mosaics_and_fs(config)
+
+    assert cat.list_granules.call_args.kwargs["filter"] is None
+    deleted = sorted(call.args[2] for call in cat.delete_granule.call_args_list)
+    assert deleted == ["id2", "id3", "id4"]
+
+
+@mock.patch("georest.time.sleep")
+@mock.patch("georest.delete_old_files_from_mosaics_and_fs")
+def test_run_cleanup_daemon(delete_old_files_from_mosaics_and_fs, sleep):
+    """Test running the cleanup periodically."""
+    from georest import run_cleanup_daemon
+
+    sleep.side_effect = [None, KeyboardInterrupt]
+    config = {"cleanup_interval": 10}
+    with pytest.raises(KeyboardInterrupt):
+        run_cleanup_daemon(config)
+
+    assert delete_old_files_from_mosaics_and_fs.call_count == 2
+    marks = delete_old_files_from_mosaics_and_fs.call_args_list[0].kwargs["high_water_marks"]
+    assert delete_old_files_from_mosaics_and_fs.call_args_list[1].kwargs["high_water_marks"] is marks
+    assert 0 < sleep.call_args.args[0] <= 600
+
+    # A failing pass doesn't stop the daemon
+    delete_old_files_from_mosaics_and_fs.reset_mock()
+    delete_old_files_from_mosaics_and_fs.side_effect = [IOError, None]
+    sleep.side_effect = [None, KeyboardInterrupt]
+    with pytest.raises(KeyboardInterrupt):
+        run_cleanup_daemon(config)
+    assert delete_old_files_from_mosaics_and_fs.call_count == 2
+
+
+def _create_store_obj(name):
+    store_obj = mock.MagicMock()
+    store_obj.name = name
+    return store_obj
+
+
+@mock.patch("georest.connect_to_gs_catalog")
+def test_delete_old_files_from_mosaics_and_fs_parallel(connect_to_gs_catalog, caplog):
+    """Test cleaning several layers in parallel."""
+    import datetime as dt
+    import logging
+
+    from georest import delete_old_files_from_mosaics_and_fs
+
+    cat = mock.MagicMock()
+    cat.mosaic_coverages.side_effect = lambda store_obj: {"coverages": {"coverage": [{"name": store_obj.name}]}}
+    cat.get_store.side_effect = lambda store, workspace: _create_store_obj(store)
+    connect_to_gs_catalog.return_value = cat
+    old_time = (dt.datetime.utcnow() - dt.timedelta(hours=2)).strftime("%Y-%m-%dT%H:%M:%S.000+0000")
+    cat.list_granules.return_value = {"features": [
+        {"properties": {"location": "/mnt/data/old.tif", "time": old_time}, "id": "id"}]}
+    http_request = cat.http_request
+
+    config = {"workspace": "satellite",
+              "max_age": 60,
+              "cleanup_workers": 3,
+              "max_host_requests": 2,
+              "layer_id": "productname",
+              "layers": {"airmass": "airmass_store", "ash": "ash_store", "dust": "dust_store"}}
+    with caplog.at_level(logging.INFO):
+        delete_old_files_from_mosaics_and_fs(config)
+
+    assert cat.delete_granule.call_count == 3
+    # The requests are limited via a wrapper
+    assert cat.http_request is not http_request
+    for store in config["layers"].values():
+        assert f"{store}: 1 granule(s) deleted in" in caplog.text
+
+    # A failing layer doesn't prevent cleaning the others
+    caplog.clear()
+    cat.delete_granule.reset_mock()
+    cat.get_store.side_effect = lambda store, workspace: (
+        None if store == "ash_store" else _create_store_obj(store))
+    with caplog.at_level(logging.INFO):
+        delete_old_files_from_mosaics_and_fs(config)
+    assert cat.delete_granule.call_count == 2
+    assert "ash_store: failed after" in caplog.text
+
+
 @mock.patch("georest.requests")
 def test_create_s3_layers(requests):
     """Test creating layers from S3 data."""
@@ -580,3 +1145,92 @@ def test_create_s3_layers(requests):
                 'headers': {'Content-type': 'text/xml'},
                 'auth': ('user', 'passwd')}
     assert last_call.kwargs == expected
+
+
+def test_async_add_granule():
+    """Test adding a granule with an aiohttp session."""
+    import asyncio
+
+    from georest import async_add_granule
+
+    meta = {"host": "http://host/", "workspace": "satellite", "layer_name": "airmass_store",
+            "image_url": "/mnt/data/europe_airmass.tif"}
+    session = mock.MagicMock()
+    response = session.post.return_value.__aenter__.return_value
+    response.status = 202
+
+    assert asyncio.run(async_add_granule(session, meta))
+    session.post.assert_called_once_with(
+        "http://host/workspaces/satellite/coveragestores/airmass_store/external.imagemosaic",
+        data="file:/mnt/data/europe_airmass.tif",
+        headers={'Content-type': 'text/plain'})
+
+    # The host can be given without the trailing slash
+    session.post.reset_mock()
+    assert asyncio.run(async_add_granule(session, dict(meta, host="http://host")))
+    assert session.post.call_args.args[0] == (
+        "http://host/workspaces/satellite/coveragestores/airmass_store/external.imagemosaic")
+
+    session.post.reset_mock()
+    response.status = 500
+    assert not asyncio.run(async_add_granule(session, meta, filesystem='s3'))
+    session.post.assert_called_once_with(
+        "http://host/workspaces/satellite/coveragestores/airmass_store/remote.imagemosaic",
+        data="/mnt/data/europe_airmass.tif",
+        headers={'Content-type': 'text/plain'})
+
+
+@mock.patch("georest.connect_to_gs_catalog")
+def test_reconcile_layers(connect_to_gs_catalog):
+    """Test reconciling layer directories with the layer granules."""
+    import os
+    import tempfile
+
+    from georest import reconcile_layers
+
+    cat = mock.MagicMock()
+    cat.mosaic_coverages.return_value = {"coverages": {"coverage": [{"name": "airmass"}]}}
+    cat.list_granules.return_value = {"features": [
+        {"properties": {"location": "/mnt/data/airmass/20200812_0900_airmass.tif"}, "id": "in-both"},
+        {"properties": {"location": "/mnt/data/airmass/20200812_0915_airmass.tif"}, "id": "no-file"},
+        {"properties": {"location": "/mnt/other/20200812_0945_airmass.tif"}, "id": "elsewhere"}]}
+    connect_to_gs_catalog.return_value = cat
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        config = {"workspace": "satellite",
+                  "geoserver_target_dir": "/mnt/data",
+                  "exposed_base_dir": tempdir,
+                  "file_pattern": "{start_time:%Y%m%d_%H%M}_{productname}.{format}",
+                  "reconcile_state_file": os.path.join(tempdir, "state.json"),
+                  "layers": [{"name": "airmass"}]}
+        layer_dir = os.path.join(tempdir, "airmass")
+        os.mkdir(layer_dir)
+        _create_extra_files(layer_dir, ["20200812_0900_airmass.tif", "20200812_0930_airmass.tif",
+                                        "20200812_0930_airmass.prj", "airmass.properties"])
+
+        with mock.patch("georest.add_granule") as add_granule:
+            reconcile_layers(config)
+            add_granule.assert_called_once_with(cat, "satellite", "airmass",
+                                                "/mnt/data/airmass/20200812_0930_airmass.tif")
+            cat.delete_granule.assert_called_once_with("airmass", cat.get_store.return_value,
+                                                       "no-file", "satellite")
+
+            # Unchanged directory is skipped on the next run
+            cat.list_granules.reset_mock()
+            reconcile_layers(config)
+            cat.list_granules.assert_not_called()
+            assert add_granule.call_count == 1
+
+        # Orphaned files can be deleted instead
+        del config["reconcile_state_file"]
+        config["orphan_files"] = "delete"
+        reconcile_layers(config)
+        assert not os.path.exists(os.path.join(layer_dir, "20200812_0930_airmass.tif"))
+        assert not os.path.exists(os.path.join(layer_dir, "20200812_0930_airmass.prj"))
+        assert os.path.exists(os.path.join(layer_dir, "airmass.properties"))
+
+        # Layers sharing a directory can't be told apart without the layer name template
+        config["create_subdirectories"] = False
+        cat.list_granules.reset_mock()
+        reconcile_layers(config)
+        cat.list_granules.assert_not_called()
@@ -125,6 +125,56 @@ def test_write_wkt_for_files():
         assert len(files) == 2
 
 
+def test_write_wkt_skips_current_files(tmp_path):
+    """Test that WKT files with the same content are not rewritten."""
+    import os
+
+    from georest.utils import write_wkt, write_wkt_for_files
+
+    config = {"write_wkt": "mock WKT string"}
+    tif_fname = tmp_path / "image.tif"
+    tif_fname.write_text("image")
+    prj_fname = tmp_path / "image.prj"
+
+    assert write_wkt_for_files(config, str(tmp_path)) == 1
+    os.utime(prj_fname, (0, 0))
+    assert write_wkt_for_files(config, str(tmp_path)) == 0
+    write_wkt(config, str(tif_fname))
+    assert prj_fname.stat().st_mtime == 0
+
+    config["write_wkt"] = "new WKT string"
+    write_wkt(config, str(tif_fname))
+    assert prj_fname.read_text() == "new WKT string"
+
+
+def test_write_wkt_hardlinks(tmp_path):
+    """Test linking the WKT files to a shared file."""
+    from georest.utils import write_wkt, write_wkt_for_directories
+
+    config = {"write_wkt": "mock WKT string", "write_wkt_hardlinks": True}
+    for layer in ("layer1", "layer2"):
+        (tmp_path / layer).mkdir()
+        for i in range(3):
+            (tmp_path / layer / f"image{i}.tif").write_text("image")
+
+    write_wkt_for_directories(config, [str(tmp_path / "layer1"), str(tmp_path / "layer2"), str(tmp_path / "layer1")])
+
+    for layer in ("layer1", "layer2"):
+        shared = list((tmp_path / layer).glob(".wkt-*.prj"))
+        assert len(shared) == 1
+        assert shared[0].read_text() == "mock WKT string"
+        assert shared[0].stat().st_nlink == 4
+        for i in range(3):
+            assert (tmp_path / layer / f"image{i}.prj").stat().st_ino == shared[0].stat().st_ino
+
+    # A changed WKT gets a new shared file, and the old links are not modified
+    config["write_wkt"] = "new WKT string"
+    write_wkt(config, str(tmp_path / "layer1" / "image0.tif"))
+    assert (tmp_path / "layer1" / "image0.prj").read_text() == "new WKT string"
+    assert (tmp_path / "layer1" / "image1.prj").read_text() == "mock WKT string"
+    assert len(list((tmp_path / "layer1").glob(".wkt-*.prj"))) == 2
+
+
 @mock.patch("georest.utils.georest")
 def test_file_in_granules(georest):
     """Test that existing files are recogniced in the store."""
@@ -142,7 +192,7 @@ def test_file_in_granules(georest):
         cat, workspace, store, file_path, identity_check_seconds, file_pattern)
     cat.get_store.assert_not_called()
     georest.get_layer_coverage.assert_not_called()
-    georest.get_layer_granules.assert_not_called()
+    georest.iter_layer_granules.assert_not_called()
 
     # Image not in layer -> returns False
     identity_check_seconds = 60
@@ -150,7 +200,7 @@ def test_file_in_granules(georest):
                 [{"properties": {"location": "/mnt/data/20200818_1100_europe_airmass.tif"},
                   "id": "file-id"}]
                 }
-    georest.get_layer_granules.return_value = granules
+    georest.iter_layer_granules.return_value = granules["features"]
     assert not file_in_granules(
         cat, workspace, store, file_path, identity_check_seconds, file_pattern)
 
@@ -160,7 +210,7 @@ def test_file_in_granules(georest):
                 [{"properties": {"location": "/mnt/data/20200818_1200_europe_airmass.tif"},
                   "id": "file-id"}]
                 }
-    georest.get_layer_granules.return_value = granules
+    georest.iter_layer_granules.return_value = granules["features"]
     assert file_in_granules(
         cat, workspace, store, file_path, identity_check_seconds, file_pattern)
 
@@ -170,7 +220,7 @@ def test_file_in_granules(georest):
                 [{"properties": {"location": "/mnt/data/20200818_1201_europe_airmass.tif"},
                   "id": "file-id"}]
                 }
-    georest.get_layer_granules.return_value = granules
+    georest.iter_layer_granules.return_value = granules["features"]
     assert file_in_granules(
         cat, workspace, store, file_path, identity_check_seconds, file_pattern)
 
@@ -180,16 +230,239 @@ def test_file_in_granules(georest):
                 [{"properties": {"location": "/mnt/data/20200818_1200_europe_ash.tif"},
                   "id": "file-id"}]
                 }
-    georest.get_layer_granules.return_value = granules
+    georest.iter_layer_granules.return_value = granules["features"]
     assert not file_in_granules(
         cat, workspace, store, file_path, identity_check_seconds, file_pattern)
 
+    # Only the granules close in time are requested from Geoserver
+    assert georest.iter_layer_granules.call_args.kwargs["cql_filter"] == (
+        "time >= '2020-08-18T11:59:00Z' AND time <= '2020-08-18T12:01:00Z'")
+
     # Filepattern and filename do not match
     file_path = "/path/to/20200818_1200_europe_airmass.l1b"
     with pytest.raises(ValueError):
         file_in_granules(cat, workspace, store, file_path, identity_check_seconds, file_pattern)
 
 
+def test_parse_filename():
+    """Test that parsed filenames are cached."""
+    import datetime as dt
+
+    from georest.utils import _parse_basename, parse_filename
+
+    file_pattern = "{start_time:%Y%m%d_%H%M}_{area}_{product}.tif"
+    _parse_basename.cache_clear()
+    res = parse_filename(file_pattern, "/path/to/20200818_1200_europe_airmass.tif")
+    assert res == {"start_time": dt.datetime(2020, 8, 18, 12, 0), "area": "europe", "product": "airmass"}
+    # Modifying the result doesn't change the cached value
+    res.pop("start_time")
+    res = parse_filename(file_pattern, "/other/path/20200818_1200_europe_airmass.tif")
+    assert "start_time" in res
+    assert _parse_basename.cache_info().hits == 1
+
+    with pytest.raises(ValueError):
+        parse_filename(file_pattern, "/path/to/20200818_1200_europe_airmass.l1b")
+
+
+def test_read_filenames(tmp_path, monkeypatch):
+    """Test reading filenames from command-line arguments, files and stdin."""
+    import io
+
+    from georest.utils import read_filenames
+
+    list_file = tmp_path / "files.txt"
+    list_file.write_text("file2.tif\n\nfile3.tif\n")
+    monkeypatch.setattr("sys.stdin", io.StringIO("file4.tif\n"))
+
+    assert read_filenames(["file1.tif", f"@{list_file}", "-"]) == ["file1.tif", "file2.tif", "file3.tif", "file4.tif"]
+
+    (tmp_path / "image2.tif").write_text("")
+    (tmp_path / "image1.tif").write_text("")
+    assert read_filenames([str(tmp_path / "*.tif")]) == [str(tmp_path / "image1.tif"), str(tmp_path / "image2.tif")]
+    (tmp_path / "image1.prj").write_text("")
+    assert read_filenames([str(tmp_path)]) == [str(tmp_path / "files.txt"), str(tmp_path / "image1.tif"),
+                                               str(tmp_path / "image2.tif")]
+
+    # URLs and existing files are not globbed
+    url = "https://bucket.host/x.tif?versionId=3"
+    assert read_filenames([url]) == [url]
+    (tmp_path / "image[1].tif").write_text("")
+    assert read_filenames([str(tmp_path / "image[1].tif")]) == [str(tmp_path / "image[1].tif")]
+
+
+def test_cql_filters():
+    """Test creating CQL filters."""
+    import datetime as dt
+
+    from georest.utils import (cql_location_filter, cql_time_before,
+                               cql_time_window)
+
+    assert cql_location_filter("europe_airmass.tif") == "location LIKE '%europe_airmass.tif%'"
+    assert cql_location_filter("it's.tif") == "location LIKE '%it''s.tif%'"
+    tim = dt.datetime(2020, 8, 18, 12, 0)
+    assert cql_time_window(tim, 300) == "time >= '2020-08-18T11:55:00Z' AND time <= '2020-08-18T12:05:00Z'"
+    assert cql_time_before(tim) == "time < '2020-08-18T12:00:00Z'"
+    assert (cql_time_before(tim, start_time=tim - dt.timedelta(hours=1)) ==
+            "time >= '2020-08-18T11:00:00Z' AND time < '2020-08-18T12:00:00Z'")
+
+
+def test_select_expired_granules():
+    """Test selecting granules to delete with retention rules."""
+    import datetime as dt
+
+    from georest.utils import select_expired_granules
+
+    now = dt.datetime(2020, 8, 18, 12, 0)
+    # Every 15 minutes for the last 4 hours, in reverse order
+    times = [(now - dt.timedelta(minutes=15 * i)).strftime("%Y-%m-%dT%H:%M:%S.000+0000") for i in range(16)]
+
+    assert select_expired_granules(times, now) == []
+    assert select_expired_granules(times, now, max_age=60) == list(range(5, 16))
+    assert select_expired_granules(times, now, max_count=3) == list(range(3, 16))
+    assert select_expired_granules(times, now, max_age=120, max_count=10) == list(range(9, 16))
+    # Keep hourly granules older than an hour
+    res = select_expired_granules(times, now, thin_after=60, thin_interval=60)
+    assert res == [5, 6, 7, 9, 10, 11, 13, 14]
+    # Thinning is stable between runs
+    remaining = [tim for i, tim in enumerate(times) if i not in res]
+    assert select_expired_granules(remaining, now, thin_after=60, thin_interval=60) == []
+    # Several granules with the same time are handled together
+    assert select_expired_granules(times[:2] + times[:2], now, max_age=10) == [1, 3]
+
+
+def test_get_retention_rule():
+    """Test getting layer specific retention rules."""
+    from georest.utils import get_retention_rule
+
+    config = {"max_age": 60,
+              "retention_rules": {"airmass_store": {"max_count": 10},
+                                  "ash_store": {"max_age": 120}}}
+    assert get_retention_rule(config, "airmass_store") == {"max_age": 60, "max_count": 10}
+    assert get_retention_rule(config, "ash_store") == {"max_age": 120}
+    assert get_retention_rule(config, "other_store") == {"max_age": 60}
+
+
+def test_get_filename_router():
+    """Test routing filenames to stores."""
+    from georest.utils import get_filename_router
+
+    config = {"file_pattern": "{area}_{productname}.tif",
+              "layer_id": "productname",
+              "layers": {"airmass": "airmass_store"}}
+    router = get_filename_router(config)
+    assert router.get_store("/path/to/europe_airmass.tif") == "airmass_store"
+    # The same router is shared
+    assert get_filename_router(config.copy()) is router
+    with pytest.raises(KeyError):
+        router.get_store("/path/to/europe_ash.tif")
+
+    config = {"file_pattern": "{area}_{productname}.tif",
+              "layer_name_template": "{productname}_{area}"}
+    router = get_filename_router(config)
+    assert router.get_store("/path/to/europe_airmass.tif") == "airmass_europe"
+
+    config = {"file_pattern": "{area}_{productname}.tif"}
+    with pytest.raises(ValueError):
+        get_filename_router(config).get_store("/path/to/europe_airmass.tif")
+
+
+@mock.patch("georest.utils.georest")
+def test_granule_index(georest):
+    """Test the local granule index."""
+    from georest.utils import GranuleIndex
+
+    cat = mock.MagicMock()
+    file_pattern = "{start_time:%Y%m%d_%H%M}_{area}_{product}.tif"
+    granules = {"features":
+                [{"properties": {"location": "/mnt/data/20200818_1100_europe_airmass.tif"},
+                  "id": "file-id"},
+                 {"properties": {"location": "/mnt/data/not_matching.tif"},
+                  "id": "file-id2"}]
+                }
+    georest.iter_layer_granules.side_effect = lambda *args: iter(granules["features"])
+
+    index = GranuleIndex(cat, "satellite", file_pattern, ttl=None)
+    # Adding to a store that isn't loaded yet does nothing
+    index.add("airmass", "/mnt/data/20200818_1300_europe_airmass.tif")
+    assert index.contains("airmass", "/path/to/20200818_1100_europe_airmass.tif", 60)
+    assert index.contains("airmass", "/path/to/20200818_1101_europe_airmass.tif", 60)
+    assert not index.contains("airmass", "/path/to/20200818_1102_europe_airmass.tif", 60)
+    assert not index.contains("airmass", "/path/to/20200818_1100_europe_ash.tif", 60)
+    assert not index.contains("airmass", "/path/to/20200818_1300_europe_airmass.tif", 60)
+    # The granules are listed only once
+    georest.iter_layer_granules.assert_called_once()
+    cat.get_store.assert_called_once_with("airmass", "satellite")
+
+    index.add("airmass", "/mnt/data/20200818_1200_europe_airmass.tif")
+    assert index.contains("airmass", "/path/to/20200818_1200_europe_airmass.tif", 60)
+    georest.iter_layer_granules.assert_called_once()
+    index.remove("airmass", "/mnt/data/20200818_1200_europe_airmass.tif")
+    assert not index.contains("airmass", "/path/to/20200818_1200_europe_airmass.tif", 60)
+    # Removing a granule that isn't in the index does nothing
+    index.remove("airmass", "/mnt/data/20200818_1200_europe_airmass.tif")
+
+    # Invalidation causes re-listing
+    index.invalidate("airmass")
+    assert index.contains("airmass", "/path/to/20200818_1100_europe_airmass.tif", 60)
+    assert georest.iter_layer_granules.call_count == 2
+
+    # Expired TTL causes re-listing
+    index = GranuleIndex(cat, "satellite", file_pattern, ttl=-1)
+    index.contains("airmass", "/path/to/20200818_1100_europe_airmass.tif", 60)
+    index.contains("airmass", "/path/to/20200818_1100_europe_airmass.tif", 60)
+    assert georest.iter_layer_granules.call_count == 4
+
+
+def test_file_deleter(caplog):
+    """Test deleting files in the background."""
+    import logging
+    import os
+    import tempfile
+
+    from georest.utils import FileDeleter
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        paths = []
+        for i in range(5):
+            path = os.path.join(tempdir, f"image{i}.tif")
+            with open(path, "w") as fid:
+                fid.write("image")
+            paths.append(path)
+
+        deleter = FileDeleter(workers=2, batch_size=2)
+        with caplog.at_level(logging.INFO):
+            for path in paths:
+                deleter.delete(path)
+            deleter.delete(os.path.join(tempdir, "missing.tif"))
+            deleter.delete(os.path.join(tempdir, "missing.prj"), warn_missing=False)
+            deleter.delete(os.path.join(tempdir, "missing_dir", "missing.tif"))
+            deleter.close()
+
+        assert os.listdir(tempdir) == []
+        assert deleter.num_files == 5
+        assert deleter.num_bytes == 25
+        assert "missing.tif not available" in caplog.text
+        assert "missing.prj" not in caplog.text
+        assert "Deleted 5 file(s)" in caplog.text
+
+
+@mock.patch("georest.utils.georest")
+def test_file_in_granules_with_index(georest):
+    """Test that the granule index is used when given."""
+    from georest.utils import file_in_granules
+
+    cat = mock.MagicMock()
+    granule_index = mock.MagicMock()
+    file_path = "/path/to/20200818_1200_europe_airmass.tif"
+    file_pattern = "{start_time:%Y%m%d_%H%M}_{area}_{product}.tif"
+
+    assert file_in_granules(cat, "satellite", "airmass", file_path, 60, file_pattern,
+                            granule_index=granule_index)
+    granule_index.contains.assert_called_once_with("airmass", file_path, 60)
+    cat.get_store.assert_not_called()
+    georest.iter_layer_granules.assert_not_called()
+
+
 @mock.patch("georest.utils.file_in_granules")
 @mock.patch("georest.utils.convert_file_path")
 @mock.patch("georest.add_granule")
@@ -228,7 +501,8 @@ def test_run_posttroll_adder(connect_to_gs_catalog, write_wkt, add_granule,
         config["layers"]["airmass"],
         convert_file_path.return_value,
         None,  # No "identity_check_seconds" set
-        None)  # No "file_pattern" in config
+        None,  # No "file_pattern" in config
+        granule_index=mock.ANY)
 
     # Set "identity_check_seconds" and "file_pattern" to config
     config["identity_check_seconds"] = 60
@@ -240,7 +514,8 @@ def test_run_posttroll_adder(connect_to_gs_catalog, write_wkt, add_granule,
         config["layers"]["airmass"],
         convert_file_path.return_value,
         config["identity_check_seconds"],
-        config["file_pattern"])
+        config["file_pattern"],
+        granule_index=mock.ANY)
 
 
 @mock.patch("georest.utils._process_message")
@@ -262,10 +537,16 @@ def test_posttroll_adder_loop_return_value(connect_to_gs_catalog, process_messag
     res = _posttroll_adder_loop(config, Subscribe, restart_timeout)
     assert res is False
 
-    # Unhandled exception
+    # A failing message doesn't stop the loop
     process_message.side_effect = IOError
     res = _posttroll_adder_loop(config, Subscribe, None)
+    assert res is True
+
+    # Unhandled exception
+    Subscribe.return_value.__enter__.return_value.recv.side_effect = IOError
+    res = _posttroll_adder_loop(config, Subscribe, None)
     assert res is False
+    Subscribe.return_value.__enter__.return_value.recv.side_effect = None
 
     # KeyboardInterrupt is the only that should return True
     process_message.side_effect = KeyboardInterrupt
@@ -273,6 +554,38 @@ def test_posttroll_adder_loop_return_value(connect_to_gs_catalog, process_messag
     assert res is True
 
 
+@mock.patch("georest.utils._process_message")
+@mock.patch("georest.connect_to_gs_catalog")
+def test_posttroll_adder_loop_batching(connect_to_gs_catalog, process_message):
+    """Test that the messages are batched and grouped by store."""
+    from georest.utils import _posttroll_adder_loop
+
+    config = {"workspace": "satellite",
+              "topics": ["/topic1", "/topic2"],
+              "layers": {"airmass": "airmass_layer_name", "ash": "ash_layer_name"},
+              "batch_max_items": 10,
+              "batch_max_ms": 60000,
+              }
+    msg1 = mock.MagicMock(data={"productname": "airmass", "uri": "/path/to/image1.tif"})
+    msg2 = mock.MagicMock(data={"productname": "ash", "uri": "/path/to/image2.tif"})
+    msg3 = mock.MagicMock(data={"productname": "airmass", "uri": "/path/to/image3.tif"})
+    Subscribe = mock.MagicMock()
+    Subscribe.return_value.__enter__.return_value.recv.return_value = [msg1, msg2, msg3, msg1, None]
+
+    _posttroll_adder_loop(config, Subscribe, None)
+    processed = [call.args[2] for call in process_message.call_args_list]
+    # Duplicate messages are dropped and messages for the same store are processed together
+    assert processed == [msg1, msg3, msg2]
+
+    # Maximum number of messages in a batch
+    process_message.reset_mock()
+    config["batch_max_items"] = 2
+    Subscribe.return_value.__enter__.return_value.recv.return_value = [msg1, msg2, msg3]
+    _posttroll_adder_loop(config, Subscribe, None)
+    processed = [call.args[2] for call in process_message.call_args_list]
+    assert processed == [msg1, msg2, msg3]
+
+
 @mock.patch("georest.utils._process_message")
 @mock.patch("georest.connect_to_gs_catalog")
 def test_posttroll_adder_loop_subscribe_config_options(connect_to_gs_catalog, process_message):
@@ -329,6 +642,390 @@ def test_run_posttroll_adder_s3(connect_to_gs_catalog, add_s3_granule,
     )
 
 
+@mock.patch("georest.evict_old_granules")
+@mock.patch("georest.utils.file_in_granules")
+@mock.patch("georest.utils.convert_file_path")
+@mock.patch("georest.add_granule")
+@mock.patch("georest.connect_to_gs_catalog")
+def test_run_posttroll_adder_evict_on_add(connect_to_gs_catalog, add_granule, convert_file_path,
+                                          file_in_granules, evict_old_granules):
+    """Test evicting old granules after a granule has been added."""
+    from georest.utils import run_posttroll_adder
+
+    config = {"workspace": "satellite",
+              "topics": ["/topic1", "/topic2"],
+              "layers": {"airmass": "airmass_layer_name"},
+              "evict_on_add": True,
+              }
+    convert_file_path.return_value = "/mnt/data/image.tif"
+    msg = mock.MagicMock(data={"productname": "airmass", "uri": "/path/to/image.tif"})
+    Subscribe = mock.MagicMock()
+    Subscribe.return_value.__enter__.return_value.recv.return_value = [msg]
+    file_in_granules.return_value = False
+
+    add_granule.return_value = False
+    run_posttroll_adder(config, Subscribe)
+    evict_old_granules.assert_not_called()
+
+    add_granule.return_value = True
+    run_posttroll_adder(config, Subscribe)
+    evict_old_granules.assert_called_once_with(mock.ANY, connect_to_gs_catalog.return_value, "airmass_layer_name")
+
+
+@mock.patch("georest.utils.time.monotonic")
+def test_caching_catalog(monotonic):
+    """Test caching the catalog lookups."""
+    from georest.utils import CachingCatalog
+
+    monotonic.return_value = 0
+    wrapped = mock.MagicMock()
+    cat = CachingCatalog(wrapped, ttl=10, max_size=2)
+
+    assert cat.get_store("store", workspace="ws") is wrapped.get_store.return_value
+    cat.get_store("store", workspace="ws")
+    assert wrapped.get_store.call_count == 1
+    # Other methods are not cached
+    cat.list_granules("coverage", "store")
+    cat.list_granules("coverage", "store")
+    assert wrapped.list_granules.call_count == 2
+
+    # Expired results are requested again
+    monotonic.return_value = 11
+    cat.get_store("store", workspace="ws")
+    assert wrapped.get_store.call_count == 2
+
+    # The least recently used results are removed first
+    cat.get_layer("layer1")
+    cat.get_store("store", workspace="ws")
+    cat.get_layer("layer2")
+    cat.get_store("store", workspace="ws")
+    assert wrapped.get_store.call_count == 2
+    cat.get_layer("layer1")
+    assert wrapped.get_layer.call_count == 3
+
+    # Mutating calls invalidate the affected lookups
+    cat.create_imagemosaic("store", "properties.zip", workspace="ws")
+    wrapped.create_imagemosaic.assert_called_once_with("store", "properties.zip", workspace="ws")
+    cat.get_store("store", workspace="ws")
+    assert wrapped.get_store.call_count == 3
+    cat.get_workspace("ws")
+    cat.save(mock.MagicMock(resource_type="layer"))
+    cat.get_workspace("ws")
+    assert wrapped.get_workspace.call_count == 1
+    cat.get_layer("layer1")
+    assert wrapped.get_layer.call_count == 4
+
+    # Attributes are set to the wrapped catalog
+    cat.http_request = "foo"
+    assert wrapped.http_request == "foo"
+
+
+def test_store_executor():
+    """Test that tasks are run in order per store and in parallel for different stores."""
+    import threading
+    import time
+
+    from georest.utils import StoreExecutor
+
+    results = []
+    slow_started = threading.Event()
+    fast_done = threading.Event()
+
+    def _slow(item):
+        slow_started.set()
+        fast_done.wait(5)
+        time.sleep(0.01)
+        results.append(item)
+
+    def _fast(item):
+        results.append(item)
+
+    def _set_fast_done():
+        fast_done.set()
+
+    executor = StoreExecutor(2, 10)
+    executor.submit("slow_store", _slow, "slow1")
+    executor.submit("slow_store", _fast, "slow2")
+    slow_started.wait(5)
+    executor.submit("fast_store", _fast, "fast1")
+    executor.submit("fast_store", _fast, "fast2")
+    executor.submit("fast_store", _set_fast_done)
+    # Exceptions are logged and do not stop the processing
+    executor.submit("fast_store", _raise_value_error)
+    executor.shutdown()
+
+    assert results == ["fast1", "fast2", "slow1", "slow2"]
+
+
+def _raise_value_error():
+    raise ValueError
+
+
+@mock.patch("georest.utils.file_in_granules")
+@mock.patch("georest.utils.convert_file_path")
+@mock.patch("georest.add_granule")
+@mock.patch("georest.utils.write_wkt")
+@mock.patch("georest.connect_to_gs_catalog")
+def test_run_posttroll_adder_workers(connect_to_gs_catalog, write_wkt, add_granule,
+                                     convert_file_path, file_in_granules):
+    """Test running posttroll adder with a thread pool."""
+    from georest.utils import run_posttroll_adder
+
+    config = {"workspace": "satellite",
+              "topics": ["/topic1", "/topic2"],
+              "layers": {"airmass": "airmass_layer_name", "ash": "ash_layer_name"},
+              "workers": 2,
+              "queue_size": 1,
+              }
+    convert_file_path.side_effect = lambda config, uri: uri
+    msgs = [mock.MagicMock(data={"productname": prod, "uri": f"/path/to/image{i}.tif"})
+            for i, prod in enumerate(["airmass", "ash", "airmass", "ash"])]
+    Subscribe = mock.MagicMock()
+    Subscribe.return_value.__enter__.return_value.recv.return_value = msgs
+    file_in_granules.return_value = False
+
+    run_posttroll_adder(config, Subscribe)
+    assert add_granule.call_count == 4
+    added = [call.args[3] for call in add_granule.call_args_list if call.args[2] == "airmass_layer_name"]
+    assert added == ["/path/to/image0.tif", "/path/to/image2.tif"]
+
+
+@mock.patch("georest.utils.convert_file_path")
+@mock.patch("georest.async_add_granule")
+@mock.patch("georest.create_async_session")
+@mock.patch("georest.utils.georest.iter_layer_granules")
+@mock.patch("georest.utils.georest.get_layer_coverage")
+@mock.patch("georest.connect_to_gs_catalog")
+def test_run_posttroll_adder_asyncio(connect_to_gs_catalog, get_layer_coverage, iter_layer_granules,
+                                     create_async_session, async_add_granule, convert_file_path):
+    """Test running posttroll adder with the asyncio engine."""
+    from georest.utils import run_posttroll_adder
+
+    config = {"workspace": "satellite",
+              "topics": ["/topic1", "/topic2"],
+              "layers": {"airmass": "airmass_layer_name"},
+              "host": "hostname",
+              "engine": "asyncio",
+              "identity_check_seconds": 60,
+              "file_pattern": "{start_time:%Y%m%d_%H%M}_{area}_{product}.tif",
+              }
+    iter_layer_granules.return_value = [
+        {"properties": {"location": "/mnt/data/20200818_1100_europe_airmass.tif"}, "id": "id"}]
+    convert_file_path.side_effect = lambda config, uri: uri
+    uris = ["/mnt/data/20200818_1100_europe_airmass.tif",
+            "/mnt/data/20200818_1200_europe_airmass.tif",
+            "/mnt/data/20200818_1200_europe_airmass.tif",
+            "/mnt/data/20200818_1300_europe_airmass.tif"]
+    msgs = [mock.MagicMock(data={"productname": "airmass", "uri": uri}) for uri in uris]
+    Subscribe = mock.MagicMock()
+    Subscribe.return_value.__enter__.return_value.recv.return_value = [None] + msgs
+    async_add_granule.return_value = True
+
+    run_posttroll_adder(config, Subscribe)
+
+    # The granules are listed once, existing and duplicate granules are not added
+    iter_layer_granules.assert_called_once()
+    session = create_async_session.return_value.__aenter__.return_value
+    async_add_granule.assert_any_call(
+        session,
+        {'host': 'hostname', 'workspace': 'satellite', 'layer_name': 'airmass_layer_name',
+         'image_url': uris[1]},
+        filesystem="posix")
+    assert async_add_granule.call_count == 2
+
+
+def test_ingest_journal():
+    """Test the journal of received messages."""
+    import datetime as dt
+    import os
+    import tempfile
+
+    from georest.utils import IngestJournal
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, "journal.sqlite")
+        journal = IngestJournal(path)
+        journal.append({"productname": "airmass", "uri": "/path/to/image1.tif"})
+        start_time = dt.datetime(2020, 8, 18, 12, 0, 15, 123456)
+        journal.append({"productname": "airmass", "uri": "/path/to/image2.tif", "start_time": start_time})
+        journal.append({"productname": "ash", "uri": "/path/to/image3.tif"})
+        assert journal.take_failed() == []
+        journal.mark_done("/path/to/image1.tif")
+        journal.mark_failed("/path/to/image2.tif")
+        # The message data is read back with the same types
+        assert journal.take_failed() == [{"productname": "airmass", "uri": "/path/to/image2.tif",
+                                          "start_time": start_time}]
+        # Taken messages are not returned again until they fail
+        assert journal.take_failed() == []
+        journal.close()
+
+        # Everything left in the journal is replayed after restart
+        journal = IngestJournal(path)
+        assert len(journal.take_failed()) == 2
+        journal.close()
+
+
+@mock.patch("georest.utils.convert_file_path")
+@mock.patch("georest.add_granule")
+@mock.patch("georest.utils.write_wkt")
+@mock.patch("georest.connect_to_gs_catalog")
+def test_run_posttroll_adder_journal(connect_to_gs_catalog, write_wkt, add_granule, convert_file_path):
+    """Test that failed messages are kept in the journal and replayed."""
+    import os
+    import tempfile
+
+    from georest.utils import IngestJournal, run_posttroll_adder
+
+    convert_file_path.side_effect = lambda config, uri: uri
+    msg = mock.MagicMock(data={"productname": "airmass", "uri": "/path/to/image1.tif"})
+    Subscribe = mock.MagicMock()
+    Subscribe.return_value.__enter__.return_value.recv.return_value = [msg]
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        config = {"workspace": "satellite",
+                  "topics": ["/topic1", "/topic2"],
+                  "layers": {"airmass": "airmass_layer_name"},
+                  "journal": os.path.join(tempdir, "journal.sqlite"),
+                  }
+        journal = IngestJournal(config["journal"])
+        journal.append({"productname": "airmass", "uri": "/path/to/image0.tif"})
+        journal.close()
+
+        # Geoserver is not available
+        add_granule.return_value = False
+        run_posttroll_adder(config, Subscribe)
+        added = [call.args[3] for call in add_granule.call_args_list]
+        assert added == ["/path/to/image0.tif", "/path/to/image1.tif"]
+
+        # Geoserver is available again, the failed messages are replayed at startup
+        add_granule.reset_mock()
+        add_granule.return_value = True
+        Subscribe.return_value.__enter__.return_value.recv.return_value = []
+        run_posttroll_adder(config, Subscribe)
+        added = sorted(call.args[3] for call in add_granule.call_args_list)
+        assert added == ["/path/to/image0.tif", "/path/to/image1.tif"]
+
+        journal = IngestJournal(config["journal"])
+        assert journal.take_failed() == []
+        journal.close()
+
+
+@mock.patch("georest.utils._process_batch")
+def test_replay_journal_to_queue(process_batch):
+    """Test that the replayed messages are put to the message queue by their age."""
+    import datetime as dt
+    import os
+    import tempfile
+
+    from georest.utils import IngestJournal, MessageQueue, _replay_journal
+
+    now = dt.datetime.utcnow()
+    with tempfile.TemporaryDirectory() as tempdir:
+        journal = IngestJournal(os.path.join(tempdir, "journal.sqlite"))
+        journal.append({"productname": "airmass", "uri": "/a/old.tif", "start_time": now - dt.timedelta(hours=5)})
+        journal.mark_failed("/a/old.tif")
+        shed = []
+        queue = MessageQueue(2, max_age=60, on_shed=shed.append)
+
+        _replay_journal(None, {}, journal, None, None, queue=queue)
+        for i in range(2):
+            queue.put(mock.MagicMock(data={"uri": f"/a/fresh{i}.tif", "start_time": now - dt.timedelta(minutes=i)}))
+        journal.close()
+
+    process_batch.assert_not_called()
+    # The old message has expired, and doesn't push out the fresh ones
+    assert [msg.data["uri"] for msg in shed] == ["/a/old.tif"]
+    assert [msg.data["uri"] for msg in queue.get_batch(10)] == ["/a/fresh0.tif", "/a/fresh1.tif"]
+
+
+def test_get_message_time_from_string():
+    """Test getting the time of a message stored as a string by older journals."""
+    import datetime as dt
+
+    from georest.utils import _get_message_time
+
+    msg = mock.MagicMock(data={"start_time": "2020-08-18 12:00:15.123456"})
+    assert _get_message_time(msg) == dt.datetime(2020, 8, 18, 12, 0, 15, 123456)
+
+
+def test_message_queue():
+    """Test the message queue giving the newest messages first."""
+    import datetime as dt
+
+    from georest.utils import MessageQueue
+
+    now = dt.datetime.utcnow()
+    msgs = [mock.MagicMock(data={"uri": f"image{i}.tif", "start_time": now - dt.timedelta(minutes=i)})
+            for i in range(5)]
+    shed = []
+
+    queue = MessageQueue(3, on_shed=shed.append)
+    for msg in reversed(msgs):
+        queue.put(msg)
+    assert len(queue) == 3
+    assert queue.shed_count == 2
+    assert shed == [msgs[4], msgs[3]]
+    assert queue.get_batch(2) == [msgs[0], msgs[1]]
+    assert queue.get_batch(2) == [msgs[2]]
+    queue.close()
+    assert queue.get_batch(2) is None
+
+    # Old messages are shed
+    shed = []
+    queue = MessageQueue(10, max_age=2, on_shed=shed.append)
+    for msg in msgs:
+        queue.put(msg)
+    assert len(queue) == 2
+    assert queue.expired_count == 3
+    assert shed == msgs[2:]
+    # Messages without a time are handled as new
+    msg = mock.MagicMock(data={"uri": "image.tif"})
+    queue.put(msg)
+    queue.close()
+    assert queue.get_batch(10) == [msg, msgs[0], msgs[1]]
+
+
+@mock.patch("georest.utils.convert_file_path")
+@mock.patch("georest.add_granule")
+@mock.patch("georest.utils.write_wkt")
+@mock.patch("georest.connect_to_gs_catalog")
+def test_run_posttroll_adder_max_message_age(connect_to_gs_catalog, write_wkt, add_granule, convert_file_path):
+    """Test that old messages are sent to the journal instead of being processed."""
+    import datetime as dt
+    import os
+    import tempfile
+
+    from georest.utils import IngestJournal, run_posttroll_adder
+
+    convert_file_path.side_effect = lambda config, uri: uri
+    now = dt.datetime.utcnow()
+    new_msg = mock.MagicMock(data={"productname": "airmass", "uri": "/path/to/new.tif", "start_time": now})
+    old_msg = mock.MagicMock(data={"productname": "airmass", "uri": "/path/to/old.tif",
+                                   "start_time": now - dt.timedelta(hours=2)})
+    Subscribe = mock.MagicMock()
+    Subscribe.return_value.__enter__.return_value.recv.return_value = [old_msg, new_msg]
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        config = {"workspace": "satellite",
+                  "topics": ["/topic1", "/topic2"],
+                  "layers": {"airmass": "airmass_layer_name"},
+                  "max_message_age": 60,
+                  "journal": os.path.join(tempdir, "journal.sqlite"),
+                  }
+        # The journal is replayed through the queue on startup, so old entries expire too
+        journal = IngestJournal(config["journal"])
+        journal.append({"productname": "airmass", "uri": "/path/to/journaled.tif",
+                        "start_time": now - dt.timedelta(hours=5)})
+        journal.close()
+        run_posttroll_adder(config, Subscribe)
+        add_granule.assert_called_once_with(connect_to_gs_catalog.return_value, "satellite",
+                                            "airmass_layer_name", "/path/to/new.tif")
+        journal = IngestJournal(config["journal"])
+        assert sorted(data["uri"] for data in journal.take_failed()) == ["/path/to/journaled.tif",
+                                                                         "/path/to/old.tif"]
+        journal.close()
+
+
 @mock.patch("georest.connect_to_gs_catalog")
 def test_run_posttroll_adder_sigterm(connect_to_gs_catalog):
     """Test sending SIGTERM to posttroll adder works."""
@@ -421,3 +1118,25 @@ def test_get_layers_for_delete_granules():
     config = {}
     with pytest.raises(ValueError):
         get_layers_for_delete_granules(config)
+
+
+def test_get_layers_for_delete_granules_existing_stores():
+    """Test that only the existing stores matching the layer name template are used."""
+    from georest.utils import get_layers_for_delete_granules
+
+    def _store(name, resource_type="coverageStore"):
+        store = mock.MagicMock(resource_type=resource_type)
+        store.name = name
+        return store
+
+    cat = mock.MagicMock()
+    cat.get_stores.return_value = [_store("optclass_fivim"), _store("optclass_fikor"),
+                                   _store("optclass_fianj", resource_type="dataStore"),
+                                   _store("other_layer")]
+    config = {"workspace": "radar", "layer_name_template": "optclass_{radar}"}
+
+    assert get_layers_for_delete_granules(config, cat=cat) == ["optclass_fikor", "optclass_fivim"]
+    cat.get_stores.assert_called_once_with(workspaces=["radar"])
+
+    config["delete_granule_layer_options"] = {"radar": ["fivim", "fikes", "fianj"]}
+    assert get_layers_for_delete_granules(config, cat=cat) == ["optclass_fivim"]
@@ -7,15 +7,26 @@
 
 """Utility functions for georest."""
 
+import bisect
+import collections
 import datetime as dt
+import functools
 import glob
+import hashlib
 import itertools
+import json
 import logging
 import logging.config
 import os
 import shutil
+import sqlite3
+import sys
 import tempfile
+import threading
+import time
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
 
 import trollsift
 import yaml
@@ -24,6 +35,14 @@ import georest
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of parsed filenames kept in memory
+FILENAME_CACHE_SIZE = 65536
+# Times in CQL filters, all the times are in UTC
+CQL_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+ISO_TIME_KEY_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# Prefix of the shared and temporary WKT files
+WKT_FILE_PREFIX = ".wkt-"
+
 
 def read_config(fname):
     """Read configuration file."""
@@ -132,24 +151,107 @@ def get_exposed_layer_directories(config):
     return dirs
 
 
-def get_layers_for_delete_granules(config):
-    """Get list of layers for deleting granules."""
+def read_filenames(args):
+    """Read filenames from command-line arguments.
+
+    An argument '-' reads the filenames from stdin, and an argument starting
+    with '@' reads them from the named manifest file, one filename per line.
+    Directories are expanded to the files in them.  URLs and existing files
+    are used as they are, and the other arguments with shell wildcards are
+    expanded with :func:`glob.glob`.
+    """
+    fnames = []
+    for arg in args:
+        if arg == "-":
+            fnames.extend(_read_lines(sys.stdin))
+        elif arg.startswith("@"):
+            with open(arg[1:], 'r') as fid:
+                fnames.extend(_read_lines(fid))
+        elif "://" in arg or os.path.isfile(arg):
+            fnames.append(arg)
+        elif os.path.isdir(arg):
+            fnames.extend(sorted(entry.path for entry in os.scandir(arg)
+                                 if entry.is_file() and not entry.name.endswith(".prj")))
+        elif any(char in arg for char in "*?["):
+            matches = sorted(glob.glob(arg))
+            if not matches:
+                logger.warning("No files matching '%s'", arg)
+            fnames.extend(matches)
+        else:
+            fnames.append(arg)
+    return fnames
+
+
+def _read_lines(fid):
+    return [line.strip() for line in fid if line.strip()]
+
+
+def read_json_state(fname):
+    """Read state saved with :func:`write_json_state`, return an empty dict if it doesn't exist."""
+    try:
+        with open(fname, 'r') as fid:
+            return json.load(fid)
+    except FileNotFoundError:
+        return {}
+
+
+def write_json_state(fname, state):
+    """Save *state* to a JSON file, replacing the file atomically."""
+    tmp_fname = fname + ".tmp"
+    with open(tmp_fname, 'w') as fid:
+        json.dump(state, fid)
+    os.replace(tmp_fname, fname)
+
+
+def get_layers_for_delete_granules(config, cat=None):
+    """Get list of layers for deleting granules.
+
+    If *cat* is given and the layers are defined with 'layer_name_template',
+    the coverage stores of the workspace are listed from Geoserver and only the
+    stores matching the template (and 'delete_granule_layer_options', if given)
+    are returned.
+    """
     if config.get("layer_id", False):
         return list(config["layers"].values())
+    if config.get("layer_name_template", False) and cat is not None:
+        return _find_template_stores(config, cat)
     if config.get("layer_name_template", False) and config.get("delete_granule_layer_options", False):
-        keys = sorted(config["delete_granule_layer_options"].keys())
-        combinations = list(itertools.product(*[config["delete_granule_layer_options"][k] for k in keys]))
-        options = [dict(zip(keys, layer)) for layer in combinations]
-        return [config["layer_name_template"].format(**opt) for opt in options]
+        return _compose_template_layers(config)
     raise ValueError(
         "Either 'layer_id' or 'layer_name_template' (with 'delete_granule_layer_options') must be defined in config"
     )
 
 
+def _find_template_stores(config, cat):
+    existing = [store.name for store in cat.get_stores(workspaces=[config["workspace"]])
+                if store.resource_type == "coverageStore"]
+    if config.get("delete_granule_layer_options", False):
+        candidates = set(_compose_template_layers(config))
+        return sorted(name for name in existing if name in candidates)
+    parser = trollsift.Parser(config["layer_name_template"])
+    stores = []
+    for name in existing:
+        try:
+            parser.parse(name)
+        except ValueError:
+            continue
+        stores.append(name)
+    return sorted(stores)
+
+
+def _compose_template_layers(config):
+    keys = sorted(config["delete_granule_layer_options"].keys())
+    combinations = list(itertools.product(*[config["delete_granule_layer_options"][k] for k in keys]))
+    options = [dict(zip(keys, layer)) for layer in combinations]
+    return [config["layer_name_template"].format(**opt) for opt in options]
+
+
 def write_wkt(config, image_fname):
     """Write WKT text besides the image file.
 
     The WKT filename is the same as *image_fname*, but the ending is '.prj'.
+    Existing files with the same WKT are not rewritten.  If 'write_wkt_hardlinks'
+    is set, the file is a hardlink to a shared WKT file in the same directory.
     """
     wkt = config.get("write_wkt")
     if wkt:
@@ -159,24 +261,254 @@ def write_wkt(config, image_fname):
             directory = config["exposed_target_dir"]
             fname = os.path.basename(image_fname)
             wkt_fname = os.path.join(directory, os.path.splitext(fname)[0] + '.prj')
-        with open(wkt_fname, 'w') as fid:
-            fid.write(wkt)
-        logger.debug("Wrote projection file: %s", wkt_fname)
+        if _write_wkt_file(config, wkt_fname, wkt):
+            logger.debug("Wrote projection file: %s", wkt_fname)
 
 
 def write_wkt_for_files(config, path):
     """Write WKT text besides all files in *path*."""
-    for fname in glob.glob(os.path.join(path, '*')):
-        # Skip projection files and directories
-        if fname.endswith('.prj') or os.path.isdir(fname):
+    wkt = config.get("write_wkt")
+    if not wkt:
+        return 0
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except FileNotFoundError:
+        logger.warning("Directory %s doesn't exist", path)
+        return 0
+    prj_inodes = {entry.name: entry.inode() for entry in entries if entry.name.endswith('.prj')}
+    num = 0
+    for entry in entries:
+        # Skip projection files, shared WKT files and directories
+        if entry.name.endswith('.prj') or entry.name.startswith(WKT_FILE_PREFIX) or entry.is_dir():
             continue
+        wkt_name = os.path.splitext(entry.name)[0] + '.prj'
         try:
-            write_wkt(config, fname)
+            num += _write_wkt_file(config, os.path.join(path, wkt_name), wkt, inode=prj_inodes.get(wkt_name))
         except PermissionError:
-            logger.warning("Could not write .prj file for %s", fname)
+            logger.warning("Could not write .prj file for %s", entry.path)
+    logger.debug("Wrote %d projection file(s) to %s", num, path)
+    return num
+
+
+def write_wkt_for_directories(config, paths, workers=4):
+    """Write WKT text besides all files in each of *paths*, the directories in parallel."""
+    paths = sorted(set(paths))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        num = sum(executor.map(lambda path: write_wkt_for_files(config, path), paths))
+    logger.info("Wrote %d projection file(s) to %d directories", num, len(paths))
+
+
+def _write_wkt_file(config, wkt_fname, wkt, inode=None):
+    """Write *wkt* to *wkt_fname* unless it's already there.
+
+    Return True if the file was written.
+    """
+    if config.get("write_wkt_hardlinks", False):
+        shared_fname = _get_shared_wkt_file(os.path.dirname(wkt_fname), wkt)
+        if inode is None:
+            try:
+                inode = os.stat(wkt_fname).st_ino
+            except FileNotFoundError:
+                pass
+        if inode == os.stat(shared_fname).st_ino:
+            return False
+        tmp_fname = _get_wkt_temp_fname(wkt_fname)
+        os.link(shared_fname, tmp_fname)
+        os.replace(tmp_fname, wkt_fname)
+        return True
+    if _file_has_content(wkt_fname, wkt):
+        return False
+    _write_file_atomically(wkt_fname, wkt)
+    return True
+
+
+def _get_shared_wkt_file(directory, wkt):
+    """Get the shared WKT file of *directory*, named by the hash of the WKT."""
+    digest = hashlib.sha1(wkt.encode("utf-8")).hexdigest()[:16]
+    shared_fname = os.path.join(directory, WKT_FILE_PREFIX + digest + ".prj")
+    if not _file_has_content(shared_fname, wkt):
+        _write_file_atomically(shared_fname, wkt)
+    return shared_fname
+
+
+def _file_has_content(fname, content):
+    try:
+        with open(fname, 'r') as fid:
+            return fid.read() == content
+    except FileNotFoundError:
+        return False
+
 
+def _write_file_atomically(fname, content):
+    """Write via a temporary file, so that files hardlinked to the old one are not changed."""
+    tmp_fname = _get_wkt_temp_fname(fname)
+    with open(tmp_fname, 'w') as fid:
+        fid.write(content)
+    os.replace(tmp_fname, fname)
 
-def file_in_granules(cat, workspace, store, file_path, identity_check_seconds, file_pattern):
+
+def _get_wkt_temp_fname(fname):
+    directory, basename = os.path.split(fname)
+    return os.path.join(directory, f"{WKT_FILE_PREFIX}tmp-{threading.get_ident()}-{basename}")
+
+
+def cql_location_filter(fname):
+    """Create a CQL filter for granules having *fname* in their location."""
+    return "location LIKE '%{}%'".format(_cql_escape(fname))
+
+
+def cql_time_window(center_time, seconds):
+    """Create a CQL filter for granules within *seconds* of *center_time*."""
+    delta = dt.timedelta(seconds=seconds)
+    return "time >= '{}' AND time <= '{}'".format(_cql_time(center_time - delta), _cql_time(center_time + delta))
+
+
+def cql_time_before(end_time, start_time=None):
+    """Create a CQL filter for granules older than *end_time*, and optionally not older than *start_time*."""
+    cql_filter = "time < '{}'".format(_cql_time(end_time))
+    if start_time is None:
+        return cql_filter
+    return "time >= '{}' AND {}".format(_cql_time(start_time), cql_filter)
+
+
+def time_key(tim):
+    """Get a sortable key for a datetime or an ISO 8601 time string in UTC.
+
+    The keys are the ISO 8601 date and time up to seconds, so the times
+    reported by Geoserver can be compared without parsing them.
+    """
+    if isinstance(tim, str):
+        return tim[:19]
+    return tim.strftime(ISO_TIME_KEY_FORMAT)
+
+
+def get_retention_rule(config, store):
+    """Get the retention rule for *store*.
+
+    Layer specific rules are given in 'retention_rules' dictionary keyed by the
+    store name, and the global 'max_age' is used as the default maximum age.
+    """
+    rule = {"max_age": config.get("max_age")}
+    rule.update(config.get("retention_rules", {}).get(store, {}))
+    return rule
+
+
+def select_expired_granules(times, now, max_age=None, max_count=None, thin_after=None, thin_interval=None):
+    """Select the granules to delete.
+
+    Args:
+        times: The granule times as ISO 8601 strings in UTC
+        now: The current time
+        max_age: Delete granules older than this many minutes
+        max_count: Keep at most this many newest granules
+        thin_after: Thin granules older than this many minutes, default is to thin all the granules
+        thin_interval: When thinning, keep only the first time step of each interval of this many minutes
+
+    Returns:
+        Sorted list of indices of the granules to delete
+
+    """
+    keys = [time_key(tim) for tim in times]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    sorted_keys = [keys[i] for i in order]
+    num_expired = 0
+    if max_age is not None:
+        num_expired = bisect.bisect_left(sorted_keys, time_key(now - dt.timedelta(minutes=max_age)))
+    if max_count is not None:
+        num_expired = max(num_expired, len(keys) - max_count)
+    expired = set(order[:num_expired])
+
+    if thin_interval:
+        if thin_after is None:
+            num_thinned = len(keys)
+        else:
+            num_thinned = bisect.bisect_left(sorted_keys, time_key(now - dt.timedelta(minutes=thin_after)))
+        kept_intervals = {}
+        for i in order[num_expired:num_thinned]:
+            interval = _get_interval_number(keys[i], thin_interval)
+            if kept_intervals.setdefault(interval, keys[i]) != keys[i]:
+                expired.add(i)
+
+    return sorted(expired)
+
+
+def _get_interval_number(key, minutes):
+    tim = dt.datetime.fromisoformat(key).replace(tzinfo=dt.timezone.utc)
+    return int(tim.timestamp()) // (60 * minutes)
+
+
+def _cql_time(tim):
+    return tim.strftime(CQL_TIME_FORMAT)
+
+
+def _cql_escape(value):
+    return value.replace("'", "''")
+
+
+def parse_filename(file_pattern, fname):
+    """Parse the basename of *fname* using trollsift *file_pattern*.
+
+    The results are cached, so repeated parsing of the same filenames is cheap.
+    """
+    return dict(_parse_basename(file_pattern, os.path.basename(fname)))
+
+
+@functools.lru_cache(maxsize=FILENAME_CACHE_SIZE)
+def _parse_basename(file_pattern, basename):
+    return trollsift.parse(file_pattern, basename)
+
+
+class FilenameRouter:
+    """Parse filenames and find the Geoserver stores they belong to.
+
+    The store is selected with either the *layer_id* filename part mapped
+    through *layers*, or by composing *layer_name_template* from the filename
+    parts.
+    """
+
+    def __init__(self, file_pattern, layer_id=None, layer_name_template=None, layers=None):
+        """Initialize the router."""
+        self.file_pattern = file_pattern
+        self._layer_id = layer_id
+        self._layer_name_template = layer_name_template
+        self._layers = layers
+
+    def parse(self, fname):
+        """Parse the filename parts of *fname*."""
+        return parse_filename(self.file_pattern, fname)
+
+    def get_store(self, fname):
+        """Get the name of the store for *fname*."""
+        file_parts = self.parse(fname)
+        if self._layer_id:
+            return self._layers[file_parts[self._layer_id]]
+        if self._layer_name_template:
+            return trollsift.compose(self._layer_name_template, file_parts)
+        raise ValueError("Either 'layer_id' or 'layer_name_template' must be defined in config")
+
+
+def get_filename_router(config):
+    """Get the filename router for *config*.
+
+    The same router is returned for all configs with identical filename and layer settings.
+    """
+    layers = config.get("layers")
+    if isinstance(layers, dict):
+        layers = tuple(sorted(layers.items()))
+    else:
+        layers = None
+    return _get_filename_router(config["file_pattern"], config.get("layer_id"),
+                                config.get("layer_name_template"), layers)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_filename_router(file_pattern, layer_id, layer_name_template, layers):
+    return FilenameRouter(file_pattern, layer_id=layer_id, layer_name_template=layer_name_template,
+                          layers=dict(layers) if layers else None)
+
+
+def file_in_granules(cat, workspace, store, file_path, identity_check_seconds, file_pattern, granule_index=None):
     """Check if a file is already in the layer granules.
 
     cat: Geoserver Catalog object
@@ -187,12 +519,18 @@ def file_in_granules(cat, workspace, store, file_path, identity_check_seconds, f
                             with files already in Geoserver.
     file_pattern: Trollsift filename pattern.  If *identity_check_seconds* match,
                   also other filename parts are compared.  If all match, return True.
+    granule_index: optional GranuleIndex object.  If given, the check is done against
+                   the local index instead of listing the granules from Geoserver.
     """
     if identity_check_seconds is not None and file_pattern is not None:
+        if granule_index is not None:
+            return granule_index.contains(store, file_path, identity_check_seconds)
+        start_time = parse_filename(file_pattern, file_path)["start_time"]
         store_obj = cat.get_store(store, workspace)
         coverage = georest.get_layer_coverage(cat, store, store_obj)
-        granules = georest.get_layer_granules(cat, coverage, store_obj)
-        for granule in granules["features"]:
+        granules = georest.iter_layer_granules(cat, coverage, store_obj,
+                                               cql_filter=cql_time_window(start_time, identity_check_seconds))
+        for granule in granules:
             if _file_equals_granule(file_path, granule, identity_check_seconds, file_pattern):
                 return True
     return False
@@ -200,9 +538,9 @@ def file_in_granules(cat, workspace, store, file_path, identity_check_seconds, f
 
 def _file_equals_granule(file_path, granule, identity_check_seconds, file_pattern):
     """Check if a file matches the given granule."""
-    file_parts = trollsift.parse(file_pattern, os.path.basename(file_path))
+    file_parts = parse_filename(file_pattern, file_path)
     granule_path = granule["properties"]["location"]
-    granule_parts = trollsift.parse(file_pattern, os.path.basename(granule_path))
+    granule_parts = parse_filename(file_pattern, granule_path)
     time_diff = file_parts.pop("start_time") - granule_parts.pop("start_time")
     if abs(time_diff.total_seconds()) > identity_check_seconds:
         return False
@@ -219,22 +557,527 @@ def _file_equals_granule(file_path, granule, identity_check_seconds, file_patter
     return False
 
 
+class GranuleIndex:
+    """Local index of the granules in Geoserver mosaic stores.
+
+    The granules of a store are listed from Geoserver when the store is first
+    used, and again after *ttl* seconds have passed.  The granules are indexed
+    by the filename parts parsed with *file_pattern*, and sorted by the start
+    time within each set of parts.
+    """
+
+    def __init__(self, cat, workspace, file_pattern, ttl=None):
+        """Initialize the index."""
+        self.cat = cat
+        self._workspace = workspace
+        self._file_pattern = file_pattern
+        self._ttl = ttl
+        self._stores = {}
+        self._load_times = {}
+
+    def contains(self, store, file_path, identity_check_seconds):
+        """Check if a matching granule is already in the *store*."""
+        start_time, key = self._parse(file_path)
+        if self.is_stale(store):
+            self.load(store)
+        granules = self._stores[store].get(key, [])
+        tolerance = dt.timedelta(seconds=identity_check_seconds)
+        idx = bisect.bisect_left(granules, (start_time - tolerance, ""))
+        if idx < len(granules) and granules[idx][0] <= start_time + tolerance:
+            logger.info("Matching granule already exists. New: %s, old: %s",
+                        file_path, granules[idx][1])
+            return True
+        return False
+
+    def add(self, store, file_path):
+        """Add a granule to the index of *store*.
+
+        Stores that have not been loaded yet are skipped, the granule will be
+        included when the store is listed from Geoserver.
+        """
+        if store in self._stores:
+            self._insert(self._stores[store], file_path)
+
+    def remove(self, store, file_path):
+        """Remove a granule from the index of *store*."""
+        if store not in self._stores:
+            return
+        start_time, key = self._parse(file_path)
+        granules = self._stores[store].get(key, [])
+        try:
+            granules.remove((start_time, file_path))
+        except ValueError:
+            pass
+
+    def invalidate(self, store=None):
+        """Force re-listing of the given *store*, or all stores if not given."""
+        if store is None:
+            self._load_times.clear()
+        else:
+            self._load_times.pop(store, None)
+
+    def is_stale(self, store):
+        """Check if the granules of *store* need to be listed from Geoserver."""
+        load_time = self._load_times.get(store)
+        return load_time is None or (self._ttl is not None and time.monotonic() - load_time > self._ttl)
+
+    def load(self, store):
+        """List the granules of *store* from Geoserver."""
+        store_obj = self.cat.get_store(store, self._workspace)
+        coverage = georest.get_layer_coverage(self.cat, store, store_obj)
+        store_granules = {}
+        num = 0
+        for granule in georest.iter_layer_granules(self.cat, coverage, store_obj):
+            num += 1
+            try:
+                self._insert(store_granules, granule["properties"]["location"])
+            except ValueError:
+                logger.debug("Granule '%s' doesn't match the filename pattern",
+                             granule["properties"]["location"])
+        self._stores[store] = store_granules
+        self._load_times[store] = time.monotonic()
+        logger.debug("Indexed %d granules for %s:%s", num, self._workspace, store)
+
+    def _insert(self, store_granules, file_path):
+        start_time, key = self._parse(file_path)
+        bisect.insort(store_granules.setdefault(key, []), (start_time, file_path))
+
+    def _parse(self, file_path):
+        file_parts = parse_filename(self._file_pattern, file_path)
+        start_time = file_parts.pop("start_time")
+        return start_time, tuple(sorted(file_parts.items()))
+
+
+class CachingCatalog:
+    """Wrap a Geoserver Catalog and cache the results of the object lookups.
+
+    The results of the lookup methods are kept for *ttl* seconds, and at most
+    *max_size* results are kept with the least recently used ones removed
+    first.  The mutating methods remove the cached results of the lookups they
+    affect, and saving or deleting objects of unknown type clears the whole
+    cache.  All the other attributes are used from the wrapped catalog.
+    """
+
+    _lookups = ("get_workspace", "get_store", "get_resource", "get_layer", "get_style")
+    _invalidated_lookups = {
+        "create_workspace": ("get_workspace",),
+        "set_default_workspace": ("get_workspace",),
+        "create_imagemosaic": ("get_store", "get_resource", "get_layer"),
+        "create_coveragestore": ("get_store", "get_resource", "get_layer"),
+        "create_datastore": ("get_store",),
+        "create_wmsstore": ("get_store",),
+        "create_featurestore": ("get_store", "get_resource", "get_layer"),
+        "publish_featuretype": ("get_resource", "get_layer"),
+        "create_wmslayer": ("get_resource", "get_layer"),
+        "create_style": ("get_style", "get_layer"),
+        "delete_style": ("get_style", "get_layer"),
+    }
+    _saved_types = {
+        "layer": ("get_layer",),
+        "coverage": ("get_resource",),
+        "featureType": ("get_resource",),
+        "coverageStore": ("get_store",),
+        "dataStore": ("get_store",),
+        "workspace": ("get_workspace",),
+    }
+
+    def __init__(self, cat, ttl=60, max_size=1024):
+        """Initialize the cache."""
+        self.__dict__.update(_cat=cat, _ttl=ttl, _max_size=max_size,
+                             _cache=collections.OrderedDict(), _lock=threading.Lock())
+
+    def __getattr__(self, name):
+        """Get cached lookup methods, and the other attributes from the wrapped catalog."""
+        attr = getattr(self._cat, name)
+        if name in self._lookups:
+            return functools.partial(self._cached_call, name, attr)
+        if name in self._invalidated_lookups:
+            return self._invalidating(attr, self._invalidated_lookups[name])
+        if name in ("save", "delete"):
+            return self._invalidating_object_call(attr)
+        if name in ("reload", "reset"):
+            return self._invalidating(attr, self._lookups)
+        return attr
+
+    def __setattr__(self, name, value):
+        """Set the attributes of the wrapped catalog."""
+        setattr(self._cat, name, value)
+
+    def invalidate(self, lookups=None):
+        """Remove the cached results of the given lookup methods, or all of them."""
+        with self._lock:
+            if lookups is None:
+                self._cache.clear()
+                return
+            for key in [key for key in self._cache if key[0] in lookups]:
+                del self._cache[key]
+
+    def _cached_call(self, name, method, *args, **kwargs):
+        key = (name, args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and now - cached[0] < self._ttl:
+                self._cache.move_to_end(key)
+                return cached[1]
+        result = method(*args, **kwargs)
+        with self._lock:
+            self._cache[key] = (now, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._max_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _invalidating(self, method, lookups):
+        def _call(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.invalidate(lookups)
+        return _call
+
+    def _invalidating_object_call(self, method):
+        def _call(obj, *args, **kwargs):
+            lookups = self._saved_types.get(getattr(obj, "resource_type", None))
+            try:
+                return method(obj, *args, **kwargs)
+            finally:
+                self.invalidate(lookups)
+        return _call
+
+
+class StoreExecutor:
+    """Run tasks in a thread pool so that the tasks for the same store are run in order.
+
+    Tasks for different stores are run in parallel in at most *max_workers*
+    threads.  Submitting a task blocks when *max_queued* tasks are waiting or
+    running.
+    """
+
+    def __init__(self, max_workers, max_queued):
+        """Initialize the executor."""
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="georest")
+        self._slots = threading.BoundedSemaphore(max_queued)
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def submit(self, store, func, *args, **kwargs):
+        """Submit a task for *store*."""
+        self._slots.acquire()
+        with self._lock:
+            if store in self._pending:
+                self._pending[store].append((func, args, kwargs))
+                return
+            self._pending[store] = collections.deque([(func, args, kwargs)])
+        self._executor.submit(self._run_store_tasks, store)
+
+    def shutdown(self, wait=True):
+        """Shutdown the executor."""
+        self._executor.shutdown(wait=wait)
+
+    def _run_store_tasks(self, store):
+        while True:
+            with self._lock:
+                tasks = self._pending[store]
+                if not tasks:
+                    del self._pending[store]
+                    return
+                func, args, kwargs = tasks.popleft()
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                logger.exception("Processing for store '%s' failed", store)
+            finally:
+                self._slots.release()
+
+
+class FileDeleter:
+    """Delete files in batches in a background thread pool.
+
+    Each directory is listed only once, so no separate existence check is
+    needed for the files.  The number of deleted files and freed bytes are
+    logged when the deleter is closed.
+    """
+
+    def __init__(self, workers=2, batch_size=100):
+        """Initialize the deleter."""
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="georest-delete")
+        self._batch_size = batch_size
+        self._batch = []
+        self._futures = []
+        self._directories = {}
+        self._lock = threading.Lock()
+        self._directory_lock = threading.Lock()
+        self._start_time = time.monotonic()
+        self.num_files = 0
+        self.num_bytes = 0
+
+    def delete(self, path, warn_missing=True):
+        """Delete *path* if it exists."""
+        with self._lock:
+            self._batch.append((path, warn_missing))
+            if len(self._batch) >= self._batch_size:
+                self._submit_batch()
+
+    def close(self):
+        """Wait for the deletions to finish and log a summary."""
+        with self._lock:
+            self._submit_batch()
+        for future in self._futures:
+            future.result()
+        self._executor.shutdown()
+        elapsed = time.monotonic() - self._start_time
+        logger.info("Deleted %d file(s), %.1f MB freed, %.1f files/s",
+                    self.num_files, self.num_bytes / 1e6, self.num_files / elapsed if elapsed > 0 else 0.)
+
+    def _submit_batch(self):
+        if self._batch:
+            self._futures.append(self._executor.submit(self._delete_batch, self._batch))
+            self._batch = []
+
+    def _delete_batch(self, batch):
+        for path, warn_missing in batch:
+            directory, fname = os.path.split(path)
+            entry = self._get_directory_entries(directory).get(fname)
+            if entry is None:
+                if warn_missing:
+                    logger.warning("File %s not available on filesystem", path)
+                continue
+            try:
+                size = entry.stat().st_size
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            logger.info("File %s deleted", path)
+            with self._lock:
+                self.num_files += 1
+                self.num_bytes += size
+
+    def _get_directory_entries(self, directory):
+        with self._directory_lock:
+            if directory not in self._directories:
+                try:
+                    with os.scandir(directory or os.path.curdir) as entries:
+                        self._directories[directory] = {entry.name: entry for entry in entries}
+                except FileNotFoundError:
+                    self._directories[directory] = {}
+            return self._directories[directory]
+
+
+class DirectFileDeleter:
+    """Delete a few known files immediately.
+
+    This has the same interface as :class:`FileDeleter`, but the directories
+    are not listed.
+    """
+
+    def delete(self, path, warn_missing=True):
+        """Delete *path* if it exists."""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            if warn_missing:
+                logger.warning("File %s not available on filesystem", path)
+            return
+        logger.info("File %s deleted", path)
+
+    def close(self):
+        """Do nothing, the files have already been deleted."""
+
+
+class IngestJournal:
+    """Journal of received messages whose granules have not been added yet.
+
+    The messages are stored in an SQLite database, one entry per file URI, and
+    removed when the granule has been added to Geoserver.  Messages that have
+    failed, or were left unprocessed by a previous run, can be taken out for
+    a retry with :meth:`take_failed`.
+    """
+
+    def __init__(self, path):
+        """Open the journal, and mark all the existing entries for replay."""
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # Commits are synced to disk only at WAL checkpoints
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS messages "
+                           "(uri TEXT PRIMARY KEY, data TEXT NOT NULL, failed INTEGER NOT NULL DEFAULT 0)")
+        self._conn.execute("UPDATE messages SET failed = 1")
+
+    def append(self, msg_data):
+        """Add message data to the journal."""
+        data = json.dumps(msg_data, default=_encode_journal_value)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO messages (uri, data, failed) VALUES (?, ?, 0)",
+                               (msg_data["uri"], data))
+
+    def mark_done(self, uri):
+        """Remove the message for *uri* from the journal."""
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE uri = ?", (uri, ))
+
+    def mark_failed(self, uri):
+        """Mark the message for *uri* to be retried."""
+        with self._lock:
+            self._conn.execute("UPDATE messages SET failed = 1 WHERE uri = ?", (uri, ))
+
+    def take_failed(self):
+        """Get the data of the failed messages, and mark them as being processed."""
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM messages WHERE failed = 1").fetchall()
+            self._conn.execute("UPDATE messages SET failed = 0 WHERE failed = 1")
+        return [json.loads(row[0], object_hook=_decode_journal_object) for row in rows]
+
+    def close(self):
+        """Close the journal."""
+        self._conn.close()
+
+
+def _encode_journal_value(value):
+    """Encode the datetimes so that they can be read back as datetimes."""
+    if isinstance(value, dt.datetime):
+        return {"__datetime__": value.isoformat()}
+    return str(value)
+
+
+def _decode_journal_object(obj):
+    if set(obj) == {"__datetime__"}:
+        return dt.datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+class MessageQueue:
+    """Bounded queue of Posttroll messages giving the newest messages first.
+
+    The messages are ordered by their 'start_time'.  When the queue is full,
+    the oldest message is shed to make room for the new one.  Messages older
+    than *max_age* minutes are shed instead of being returned.  The shed
+    messages are passed to *on_shed* callable.
+    """
+
+    def __init__(self, maxsize, max_age=None, on_shed=None):
+        """Initialize the queue."""
+        self._maxsize = maxsize
+        self._max_age = dt.timedelta(minutes=max_age) if max_age else None
+        self._on_shed = on_shed
+        self._items = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.shed_count = 0
+        self.expired_count = 0
+
+    def __len__(self):
+        """Get the number of messages in the queue."""
+        with self._cond:
+            return len(self._items)
+
+    def put(self, msg):
+        """Put a message to the queue."""
+        start_time = _get_message_time(msg)
+        shed = []
+        with self._cond:
+            if self._is_expired(start_time):
+                self.expired_count += 1
+                shed.append(msg)
+            else:
+                bisect.insort(self._items, (start_time, next(self._counter), msg))
+                if len(self._items) > self._maxsize:
+                    self.shed_count += 1
+                    shed.append(self._items.pop(0)[2])
+                self._cond.notify()
+        self._shed(shed)
+
+    def get_batch(self, max_items):
+        """Get at most *max_items* newest messages.
+
+        Block until there are messages available.  Return None when the
+        queue has been closed and all the messages have been taken.
+        """
+        msgs = []
+        shed = []
+        with self._cond:
+            while not msgs:
+                while not self._items and not self._closed:
+                    self._cond.wait()
+                if not self._items:
+                    break
+                while self._items and len(msgs) < max_items:
+                    start_time, _, msg = self._items.pop()
+                    if self._is_expired(start_time):
+                        self.expired_count += 1
+                        shed.append(msg)
+                    else:
+                        msgs.append(msg)
+        self._shed(shed)
+        return msgs or None
+
+    def close(self):
+        """Close the queue."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _is_expired(self, start_time):
+        return self._max_age is not None and dt.datetime.utcnow() - start_time > self._max_age
+
+    def _shed(self, msgs):
+        if self._on_shed is not None:
+            for msg in msgs:
+                self._on_shed(msg)
+
+
+def _get_message_time(msg):
+    """Get the nominal time of the message data, or the current time if not available."""
+    start_time = msg.data.get("start_time")
+    if isinstance(start_time, str):
+        # Messages stored in the journal by older versions have the time as a string
+        try:
+            start_time = dt.datetime.fromisoformat(start_time)
+        except ValueError:
+            pass
+    if not isinstance(start_time, dt.datetime):
+        return dt.datetime.utcnow()
+    return start_time.replace(tzinfo=None)
+
+
 def run_posttroll_adder(config, Subscribe):
     """Run granule adder using Posttroll messaging.
 
     Restart if configured restart timeout happens between incoming messages.
     """
     restart_timeout = config.get("restart_timeout")
-    while True:
-        logger.debug("Starting Posttroll adder loop")
-        if _posttroll_adder_loop(config, Subscribe, restart_timeout):
-            logger.info("Posttroll Geoserver updater stopped.")
-            return
+    executor = None
+    journal = None
+    if config.get("workers"):
+        executor = StoreExecutor(config["workers"], config.get("queue_size", 100))
+    if config.get("journal"):
+        journal = IngestJournal(config["journal"])
+    try:
+        while True:
+            logger.debug("Starting Posttroll adder loop")
+            if config.get("engine") == "asyncio":
+                stop = _run_async_posttroll_adder_loop(config, Subscribe, restart_timeout, journal=journal)
+            else:
+                stop = _posttroll_adder_loop(config, Subscribe, restart_timeout, executor=executor, journal=journal)
+            if stop:
+                logger.info("Posttroll Geoserver updater stopped.")
+                return
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if journal is not None:
+            journal.close()
 
 
-def _posttroll_adder_loop(config, Subscribe, restart_timeout):
+def _posttroll_adder_loop(config, Subscribe, restart_timeout, executor=None, journal=None):
     """Run adder until exit via KeyboardInterrupt happens.
 
+    If *executor* is given, the messages are processed in its thread pool.  If
+    *journal* is given, the received messages are stored in it until their
+    granules have been added, and failed messages are retried.
+
     Return False if no messages have been received within given time.
     """
     import signal
@@ -249,18 +1092,32 @@ def _posttroll_adder_loop(config, Subscribe, restart_timeout):
     signal.signal(signal.SIGTERM, _signal_handler)
 
     cat = georest.connect_to_gs_catalog(config)
+    granule_index = GranuleIndex(cat, config["workspace"], config.get("file_pattern"),
+                                 ttl=config.get("granule_index_ttl", 600))
 
     latest_message_time = dt.datetime.utcnow()
 
-    topics = config["topics"]
-    services = config.get("services", "")
-    nameserver = config.get("nameserver", "localhost")
-    addresses = config.get("addresses")
-    addr_listener = config.get("use_address_listener", True)
+    batch = []
+    batch_start_time = time.monotonic()
+    batch_max_items = config.get("batch_max_items", 1)
+    batch_max_seconds = config.get("batch_max_ms", 0) / 1000.
+
+    retry_interval = config.get("journal_retry_interval", 60)
+    latest_retry_time = time.monotonic()
+
+    queue = None
     return_value = False
-    with Subscribe(services=services, topics=topics, nameserver=nameserver,
-                   addresses=addresses, addr_listener=addr_listener) as sub:
+    with _subscribe(config, Subscribe) as sub:
         try:
+            if config.get("priority_queue_size") or config.get("max_message_age"):
+                queue = MessageQueue(config.get("priority_queue_size", 1000), max_age=config.get("max_message_age"),
+                                     on_shed=lambda msg: _shed_message(journal, msg))
+                queue_processor = threading.Thread(
+                    target=_process_queue,
+                    args=(cat, config, queue, batch_max_items, granule_index, executor, journal))
+                queue_processor.start()
+            if journal is not None:
+                _replay_journal(cat, config, journal, granule_index, executor, queue=queue)
             for msg in sub.recv(1):
                 if restart_timeout:
                     time_since_last_msg = dt.datetime.utcnow() - latest_message_time
@@ -270,25 +1127,294 @@ def _posttroll_adder_loop(config, Subscribe, restart_timeout):
                                      time_since_last_msg)
                         return return_value
                 if msg is None:
+                    if batch:
+                        _process_batch(cat, config, batch, granule_index=granule_index, executor=executor,
+                                       journal=journal)
+                        batch = []
+                    elif (journal is not None and (queue is None or not len(queue)) and
+                          time.monotonic() - latest_retry_time > retry_interval):
+                        _replay_journal(cat, config, journal, granule_index, executor, queue=queue)
+                        latest_retry_time = time.monotonic()
                     if sigterm_caught:
                         break
                     continue
                 logger.debug("New message received: %s", str(msg))
                 latest_message_time = dt.datetime.utcnow()
-                try:
-                    _process_message(cat, config.copy(), msg)
-                except ValueError:
-                    logger.warning("Filename pattern doesn't match.")
+                if journal is not None:
+                    journal.append(msg.data)
+                if queue is not None:
+                    queue.put(msg)
+                    continue
+                if not batch:
+                    batch_start_time = time.monotonic()
+                batch.append(msg)
+                if len(batch) >= batch_max_items or time.monotonic() - batch_start_time >= batch_max_seconds:
+                    _process_batch(cat, config, batch, granule_index=granule_index, executor=executor,
+                                   journal=journal)
+                    batch = []
+            if batch:
+                _process_batch(cat, config, batch, granule_index=granule_index, executor=executor,
+                               journal=journal)
             # This is a workaround for the unit tests
             return_value = True
         except KeyboardInterrupt:
             return_value = True
         finally:
+            if queue is not None:
+                queue.close()
+                queue_processor.join()
             return return_value  # noqa:B012
 
 
-def _process_message(cat, config, msg):
-    """Process posttroll message."""
+def _subscribe(config, Subscribe):
+    """Create the Posttroll subscriber."""
+    topics = config["topics"]
+    services = config.get("services", "")
+    nameserver = config.get("nameserver", "localhost")
+    addresses = config.get("addresses")
+    addr_listener = config.get("use_address_listener", True)
+    return Subscribe(services=services, topics=topics, nameserver=nameserver,
+                     addresses=addresses, addr_listener=addr_listener)
+
+
+def _process_queue(cat, config, queue, batch_max_items, granule_index, executor, journal):
+    """Process the messages from *queue*, newest first, until the queue is closed."""
+    while True:
+        msgs = queue.get_batch(batch_max_items)
+        if msgs is None:
+            return
+        logger.debug("Queue depth: %d, shed: %d, expired: %d",
+                     len(queue), queue.shed_count, queue.expired_count)
+        try:
+            _process_batch(cat, config, msgs, granule_index=granule_index, executor=executor, journal=journal)
+        except Exception:
+            logger.exception("Processing messages failed")
+
+
+def _shed_message(journal, msg):
+    if journal is None:
+        logger.warning("Message for '%s' dropped", msg.data["uri"])
+    else:
+        logger.warning("Message for '%s' stored to journal for a later retry", msg.data["uri"])
+        journal.mark_failed(msg.data["uri"])
+
+
+def _replay_journal(cat, config, journal, granule_index, executor, queue=None):
+    """Process the failed messages in the journal again.
+
+    If *queue* is given, the messages are put to it, so that they are
+    processed by the queue processor thread.
+    """
+    msgs = [SimpleNamespace(data=data) for data in journal.take_failed()]
+    if not msgs:
+        return
+    logger.info("Retrying %d message(s) from the journal", len(msgs))
+    if queue is not None:
+        for msg in msgs:
+            queue.put(msg)
+    else:
+        _process_batch(cat, config, msgs, granule_index=granule_index, executor=executor, journal=journal)
+
+
+def _run_async_posttroll_adder_loop(config, Subscribe, restart_timeout, journal=None):
+    """Run the asyncio version of the adder loop.
+
+    Return True if the adder should be stopped.
+    """
+    import asyncio
+
+    try:
+        return asyncio.run(_async_posttroll_adder_loop(config, Subscribe, restart_timeout, journal=journal))
+    except KeyboardInterrupt:
+        return True
+
+
+async def _async_posttroll_adder_loop(config, Subscribe, restart_timeout, journal=None):
+    """Run adder with the granule additions as concurrent asyncio tasks.
+
+    The messages are received in a separate thread, and at most
+    'max_concurrent_requests' messages are processed at the same time.
+
+    Return False if no messages have been received within given time.
+    """
+    import asyncio
+    import signal
+
+    sigterm_caught = False
+
+    def _signal_handler(signum, frame):
+        nonlocal sigterm_caught
+        logger.info("Caught SIGTERM, stop posttroll adder when there are no new messages.")
+        sigterm_caught = True
+
+    signal.signal(signal.SIGTERM, _signal_handler)
+
+    cat = georest.connect_to_gs_catalog(config)
+    granule_index = GranuleIndex(cat, config["workspace"], config.get("file_pattern"),
+                                 ttl=config.get("granule_index_ttl", 600))
+    store_locks = collections.defaultdict(asyncio.Lock)
+    semaphore = asyncio.Semaphore(config.get("max_concurrent_requests", 100))
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    end_of_messages = object()
+
+    async def _start_task(msg):
+        await semaphore.acquire()
+        task = asyncio.create_task(
+            _async_handle_message(session, config.copy(), msg, granule_index, store_locks, journal))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        task.add_done_callback(lambda _: semaphore.release())
+
+    async def _replay():
+        for data in journal.take_failed():
+            await _start_task(SimpleNamespace(data=data))
+
+    retry_interval = config.get("journal_retry_interval", 60)
+    latest_retry_time = time.monotonic()
+    latest_message_time = dt.datetime.utcnow()
+    return_value = False
+    async with georest.create_async_session(config) as session:
+        with _subscribe(config, Subscribe) as sub:
+            messages = iter(sub.recv(1))
+            try:
+                if journal is not None:
+                    await _replay()
+                while True:
+                    msg = await loop.run_in_executor(None, next, messages, end_of_messages)
+                    if msg is end_of_messages:
+                        break
+                    if restart_timeout:
+                        time_since_last_msg = dt.datetime.utcnow() - latest_message_time
+                        time_since_last_msg = time_since_last_msg.total_seconds() / 60.
+                        if time_since_last_msg > restart_timeout:
+                            logger.debug("%.0f minutes since last message",
+                                         time_since_last_msg)
+                            return return_value
+                    if msg is None:
+                        if journal is not None and time.monotonic() - latest_retry_time > retry_interval:
+                            await _replay()
+                            latest_retry_time = time.monotonic()
+                        if sigterm_caught:
+                            break
+                        continue
+                    logger.debug("New message received: %s", str(msg))
+                    latest_message_time = dt.datetime.utcnow()
+                    if journal is not None:
+                        journal.append(msg.data)
+                    await _start_task(msg)
+                return_value = True
+            except Exception:
+                logger.exception("Posttroll adder loop failed")
+            finally:
+                if tasks:
+                    await asyncio.gather(*tasks)
+    return return_value
+
+
+async def _async_handle_message(session, config, msg, granule_index, store_locks, journal):
+    done = False
+    try:
+        done = await _async_process_message(session, config, msg, granule_index, store_locks)
+    except ValueError:
+        logger.warning("Filename pattern doesn't match.")
+        done = True
+    except Exception:
+        logger.exception("Processing message failed")
+    if journal is not None:
+        _update_journal(journal, msg, done)
+
+
+async def _async_process_message(session, config, msg, granule_index, store_locks):
+    """Process posttroll message using asyncio.
+
+    Return False if adding the granule failed.
+    """
+    import asyncio
+
+    prod = msg.data["productname"]
+    store = config["layers"].get(prod)
+    workspace = config["workspace"]
+    identity_check_seconds = config.get("identity_check_seconds")
+    filesystem = config.get("filesystem", "posix")
+    check_identity = identity_check_seconds is not None and config.get("file_pattern") is not None
+
+    fname = convert_file_path(config, msg.data["uri"])
+    if store is None:
+        logger.error("No layer name for '%s'", prod)
+        return True
+    if filesystem not in ("posix", "s3"):
+        raise NotImplementedError("Can't add granules to filesystem '%s'" % filesystem)
+    if check_identity:
+        async with store_locks[store]:
+            if granule_index.is_stale(store):
+                await asyncio.to_thread(granule_index.load, store)
+        if granule_index.contains(store, fname, identity_check_seconds):
+            return True
+        # Reserve the granule so that concurrent messages for the same file are skipped
+        granule_index.add(store, fname)
+    if filesystem == "posix":
+        # Write WKT to file if configured
+        write_wkt(config, fname)
+    meta = {
+        'host': config['host'],
+        'workspace': workspace,
+        'layer_name': store,
+        'image_url': fname,
+    }
+    added = await georest.async_add_granule(session, meta, filesystem=filesystem)
+    if not added and check_identity:
+        granule_index.remove(store, fname)
+    if added and config.get("evict_on_add", False):
+        async with store_locks[store]:
+            await asyncio.to_thread(georest.evict_old_granules, config, granule_index.cat, store)
+    return added
+
+
+def _process_batch(cat, config, msgs, granule_index=None, executor=None, journal=None):
+    """Process a batch of posttroll messages grouped by the target store.
+
+    Messages for the same file within the batch are processed only once.
+    """
+    groups = {}
+    for msg in msgs:
+        store = config["layers"].get(msg.data["productname"])
+        groups.setdefault(store, {}).setdefault(msg.data["uri"], msg)
+    for store, store_msgs in groups.items():
+        if store is not None:
+            logger.debug("Processing %d message(s) for store '%s'", len(store_msgs), store)
+        for msg in store_msgs.values():
+            if executor is None:
+                _handle_message(cat, config, msg, granule_index, journal)
+            else:
+                executor.submit(store, _handle_message, cat, config, msg, granule_index, journal)
+
+
+def _handle_message(cat, config, msg, granule_index, journal):
+    done = False
+    try:
+        done = _process_message(cat, config.copy(), msg, granule_index=granule_index)
+    except ValueError:
+        logger.warning("Filename pattern doesn't match.")
+        done = True
+    except Exception:
+        logger.exception("Processing message failed")
+    if journal is not None:
+        _update_journal(journal, msg, done)
+
+
+def _update_journal(journal, msg, done):
+    if done:
+        journal.mark_done(msg.data["uri"])
+    else:
+        journal.mark_failed(msg.data["uri"])
+
+
+def _process_message(cat, config, msg, granule_index=None):
+    """Process posttroll message.
+
+    Return False if adding the granule failed.
+    """
     prod = msg.data["productname"]
     store = config["layers"].get(prod)
     workspace = config["workspace"]
@@ -300,15 +1426,15 @@ def _process_message(cat, config, msg):
     fname = convert_file_path(config, msg.data["uri"])
     if store is None:
         logger.error("No layer name for '%s'", prod)
-        return
+        return True
     if file_in_granules(cat, workspace, store, fname,
-                        identity_check_seconds, file_pattern):
-        return
+                        identity_check_seconds, file_pattern, granule_index=granule_index):
+        return True
     if filesystem == "posix":
         # Write WKT to file if configured
         write_wkt(config, fname)
         # Add the granule metadata to Geoserver
-        georest.add_granule(cat, config["workspace"], store, fname)
+        added = georest.add_granule(cat, config["workspace"], store, fname)
     elif filesystem == "s3":
         meta = {
             'host': config['host'],
@@ -316,6 +1442,11 @@ def _process_message(cat, config, msg):
             'layer_name': store,
             'image_url': fname,
         }
-        georest.add_s3_granule(config, meta)
+        added = georest.add_s3_granule(config, meta)
     else:
         raise NotImplementedError("Can't add granules to filesystem '%s'" % filesystem)
+    if added and granule_index is not None and file_pattern is not None:
+        granule_index.add(store, fname)
+    if added and config.get("evict_on_add", False):
+        georest.evict_old_granules(config, cat, store)
+    return added